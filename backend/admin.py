@@ -0,0 +1,265 @@
+import csv
+import hmac
+import io
+import json
+import os
+from datetime import datetime
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+
+from models import Referral, StoreItem, User, UserItem, UserTask, db
+from profiler import (
+    current_session,
+    folded_lines,
+    hot_functions,
+    list_sessions,
+    load_profile,
+    session_defaults,
+    start_session,
+    stop_session,
+)
+from sharding import each_shard
+
+admin = Blueprint('admin', __name__, url_prefix='/api/admin')
+
+# Rows are read in keyset batches (WHERE id > last ORDER BY id LIMIT n)
+# rather than through one long-lived cursor: each batch is a short read, so
+# an export of the whole table neither holds memory nor keeps SQLite's
+# shared lock away from the writers for minutes. With sharded user tables
+# each shard is exported in turn.
+EXPORT_BATCH_SIZE = int(os.environ.get('ADMIN_EXPORT_BATCH_SIZE', 1000))
+
+
+def export_users(args):
+    return select(
+        User.id, User.user_id, User.username, User.balance, User.wallet_address, User.referral_code,
+        User.referral_count, User.mining_multiplier, User.balance_multiplier,
+        User.last_claim, User.created_at
+    ).where(*user_filters(args, User)), User.id
+
+
+def export_referrals(args):
+    referrer = aliased(User)
+    return select(
+        Referral.id,
+        referrer.user_id.label('referrer_user_id'),
+        Referral.referred_id,
+        Referral.claimed
+    ).join(referrer, Referral.referrer_id == referrer.id).where(*user_filters(args, referrer)), Referral.id
+
+
+def add_referred_users(rows):
+    # The referred user may live on another shard than the referral, so
+    # they are looked up per batch rather than joined
+    ids = [row['referred_id'] for row in rows]
+    referred = {
+        user.id: user for user in db.session.execute(
+            select(User.id, User.user_id, User.username, User.created_at).where(User.id.in_(ids))
+        )
+    } if ids else {}
+    for row in rows:
+        user = referred.get(row.pop('referred_id'))
+        row['referred_user_id'] = user.user_id if user else None
+        row['referred_username'] = user.username if user else None
+        row['referred_at'] = user.created_at if user else None
+        row['claimed'] = row.pop('claimed')
+    return rows
+
+
+def export_tasks(args):
+    return select(
+        UserTask.id, User.user_id, UserTask.task_id, UserTask.completed, UserTask.completed_at,
+        UserTask.claimed, UserTask.claimed_at
+    ).join(User, UserTask.user_id == User.id).where(*user_filters(args, User)), UserTask.id
+
+
+def export_items(args):
+    return select(
+        UserItem.id, User.user_id, UserItem.item_id, UserItem.purchased_at
+    ).join(User, UserItem.user_id == User.id).where(*user_filters(args, User)), UserItem.id
+
+
+EXPORTS = {'users': export_users, 'referrals': export_referrals, 'tasks': export_tasks, 'items': export_items}
+# Per-batch post-processing, for columns that cannot be joined in
+ENRICH = {'referrals': add_referred_users}
+COLUMNS = {'referrals': ['id', 'referrer_user_id', 'referred_user_id', 'referred_username', 'referred_at', 'claimed']}
+
+
+def user_filters(args, user):
+    # Filters select users; referrals and task completions are exported for
+    # the selected users (the referrer, for referrals). Users created before
+    # created_at existed have no join date and are left out by joined_since.
+    conditions = []
+    if args.get('min_balance') is not None:
+        conditions.append(user.balance >= float(args['min_balance']))
+    if args.get('max_balance') is not None:
+        conditions.append(user.balance <= float(args['max_balance']))
+    if args.get('has_wallet') is not None:
+        wallet_set = user.wallet_address.isnot(None) & (user.wallet_address != '')
+        conditions.append(wallet_set if args['has_wallet'].lower() in ('1', 'true', 'yes') else ~wallet_set)
+    if args.get('joined_since'):
+        conditions.append(user.created_at >= datetime.fromisoformat(args['joined_since']))
+    return conditions
+
+
+def stream_rows(query, key, batch_size, enrich=None):
+    for bind_arguments in each_shard(db):
+        last = None
+        while True:
+            batch_query = query.order_by(key).limit(batch_size)
+            if last is not None:
+                batch_query = batch_query.where(key > last)
+            rows = [row._asdict() for row in db.session.execute(batch_query, bind_arguments=bind_arguments)]
+            if enrich:
+                rows = enrich(rows)
+            # End the read transaction between batches
+            db.session.rollback()
+            yield from rows
+            if len(rows) < batch_size:
+                break
+            last = rows[-1]['id']
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps({name: _value(value) for name, value in row.items()}) + '\n'
+
+
+def csv_lines(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(['' if value is None else _value(value) for value in row.values()])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+@admin.before_request
+def require_admin_token():
+    # Admin routes are off unless ADMIN_TOKEN is set; requests authenticate
+    # with "Authorization: Bearer <ADMIN_TOKEN>".
+    token = os.environ.get('ADMIN_TOKEN')
+    if not token:
+        return jsonify({'error': 'Not found'}), 404
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        current_app.logger.warning("Rejected admin request to %s", request.path)
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+
+@admin.route('/export/<kind>', methods=['GET'])
+def export(kind):
+    build = EXPORTS.get(kind)
+    if not build:
+        return jsonify({'error': f"Unknown export {kind}, expected one of {sorted(EXPORTS)}"}), 404
+    output = request.args.get('format', 'ndjson')
+    if output not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    try:
+        query, key = build(request.args)
+    except ValueError as error:
+        return jsonify({'error': f"Invalid filter: {error}"}), 400
+    batch_size = min(max(request.args.get('batch_size', EXPORT_BATCH_SIZE, type=int), 1), 10000)
+
+    current_app.logger.info("Admin export of %s as %s, filters: %s", kind, output, dict(request.args))
+    rows = stream_rows(query, key, batch_size, ENRICH.get(kind))
+    if output == 'csv':
+        body = csv_lines(rows, COLUMNS.get(kind) or [column.name for column in query.selected_columns])
+        mimetype = 'text/csv'
+    else:
+        body = ndjson_lines(rows)
+        mimetype = 'application/x-ndjson'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f"attachment; filename={kind}.{output}"
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@admin.route('/stats/items', methods=['GET'])
+def item_stats():
+    # Owner counts per store item, counted on the UserItem item_id index
+    # (per shard, then summed here)
+    owners = {}
+    for item_id, count in db.session.execute(
+        select(UserItem.item_id, func.count(UserItem.id)).group_by(UserItem.item_id)
+    ):
+        owners[item_id] = owners.get(item_id, 0) + count
+    items = db.session.execute(select(StoreItem.id, StoreItem.name, StoreItem.currency).order_by(StoreItem.id))
+    return jsonify([
+        {'item_id': id, 'name': name, 'currency': currency, 'owners': owners.get(id, 0)}
+        for id, name, currency in items
+    ])
+
+
+@admin.route('/profile', methods=['GET'])
+def profile_status():
+    return jsonify({'running': current_session(), 'sessions': list_sessions()})
+
+
+@admin.route('/profile', methods=['POST'])
+def start_profile():
+    # Body (all optional): seconds, rate (fraction of requests sampled) and
+    # interval_ms (time between stack samples); see profiler.py
+    if current_session():
+        return jsonify({'error': 'A profiling session is already running'}), 409
+    options = session_defaults()
+    data = request.get_json(silent=True) or {}
+    try:
+        for name in options:
+            if data.get(name) is not None:
+                options[name] = float(data[name])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'seconds, rate and interval_ms must be numbers'}), 400
+    if not (0 < options['seconds'] <= 3600 and 0 < options['rate'] <= 1 and 1 <= options['interval_ms'] <= 1000):
+        return jsonify({'error': 'Expected 0 < seconds <= 3600, 0 < rate <= 1 and 1 <= interval_ms <= 1000'}), 400
+    session = start_session(options['seconds'], options['rate'], options['interval_ms'])
+    current_app.logger.info("Profiling session %s started for %ss at rate %s", session['id'], options['seconds'], options['rate'])
+    return jsonify(session), 201
+
+
+@admin.route('/profile', methods=['DELETE'])
+def stop_profile():
+    session = stop_session()
+    if not session:
+        return jsonify({'error': 'No profiling session is running'}), 404
+    current_app.logger.info("Profiling session %s stopped", session['id'])
+    return jsonify(session)
+
+
+@admin.route('/profile/<session_id>', methods=['GET'])
+def profile_report(session_id):
+    # format=folded returns the merged collapsed stacks (for flamegraph.pl or
+    # speedscope); the default JSON has per-route totals and the top hot
+    # functions. route= narrows either to one endpoint.
+    if session_id not in list_sessions():
+        return jsonify({'error': f"No profile {session_id}"}), 404
+    output = request.args.get('format', 'json')
+    if output not in ('json', 'folded'):
+        return jsonify({'error': 'format must be json or folded'}), 400
+    stacks, requests = load_profile(session_id, request.args.get('route'))
+    if output == 'folded':
+        response = Response(folded_lines(stacks), mimetype='text/plain')
+        response.headers['Content-Disposition'] = f"attachment; filename={session_id}.folded"
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    samples = {}
+    for stack, count in stacks.items():
+        route = stack.split(';', 1)[0]
+        samples[route] = samples.get(route, 0) + count
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 500)
+    return jsonify({
+        'session': session_id,
+        'samples': sum(samples.values()),
+        'routes': {route: {'requests': requests[route], 'samples': samples.get(route, 0)} for route in requests},
+        'top': hot_functions(stacks, limit),
+    })
@@ -1,72 +1,39 @@
-from flask import Flask, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Blueprint, Flask, Response, current_app, request, jsonify
 from flask_cors import CORS
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import cast, exists, func, insert, inspect, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
-import logging
-import random
-import string
+from itertools import islice
+import atexit
+import heapq
+import time
 import os
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": ["http://localhost:3000", "https://yara-miner-bot.vercel.app", "https://t.me"]}})
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///yara_game.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String(80), unique=True, nullable=False)
-    username = db.Column(db.String(80), nullable=False)
-    balance = db.Column(db.Float, default=1000)
-    last_claim = db.Column(db.DateTime)
-    cipher_solved = db.Column(db.Boolean, default=False)
-    next_cipher_time = db.Column(db.DateTime)
-    last_referral_claim = db.Column(db.DateTime)
-    referral_code = db.Column(db.String(10), unique=True, nullable=False)
-    daily_earnings = db.Column(db.Float, default=0)
-    last_earnings_update = db.Column(db.DateTime)
-    wallet_address = db.Column(db.String(255))
-    last_ton_purchase = db.Column(db.DateTime)
-    balance_multiplier = db.Column(db.Float, default=1.0)
-    mining_multiplier = db.Column(db.Float, default=1.0)
-    purchased_multipliers = db.Column(db.String(255), default='')
-
-class StoreItem(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.String(255))
-    price = db.Column(db.Float, nullable=False)
-    currency = db.Column(db.String(10), nullable=False)
-    multiplier = db.Column(db.Float, nullable=False)
-
-class Referral(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    referrer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    referred_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    claimed = db.Column(db.Boolean, default=False)
-
-class Task(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    description = db.Column(db.String(200), nullable=False)
-    reward = db.Column(db.Float, nullable=False)
-    type = db.Column(db.String(50), nullable=False)
-    url = db.Column(db.String(200))
-    required_count = db.Column(db.Integer, default=1)
-    required_balance = db.Column(db.Integer)
-
-class UserTask(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
-    completed = db.Column(db.Boolean, default=False)
-    completed_at = db.Column(db.DateTime)
-    claimed = db.Column(db.Boolean, default=False)
-    claimed_at = db.Column(db.DateTime)
+from admin import admin
+from catalog import CatalogCache
+from cipher import cipher_state, current_epoch, next_reset, puzzle_for
+from events import EventHub, stream
+from idempotency import init_idempotency
+from ledger import BalanceLedger
+from leaderboard import Leaderboard
+from logconfig import configure_logging, log_payload
+from metrics import init_metrics
+from profiler import init_profiler
+from models import CatalogVersion, CipherPuzzle, MiningRate, Referral, ReplicaHeartbeat, Sequence, StoreItem, Task, User, UserItem, UserTask, db
+from ratelimit import init_rate_limits
+from readsplit import init_read_split
+from referralcodes import ReferralCodes
+from schema import upgrade_schema
+from sequences import SequenceBlocks
+from sharding import MAIN, SHARDED_TABLES, allocate_user_id, configure_shards, each_shard, shard_engines
+from sharedstate import SharedCounters
+from storage import configure_storage, init_storage, worker_threads
+from verification import VERIFIED, VerificationPipeline, telegram_provider, twitter_provider
+from writebehind import WriteBehind, WriteBehindFull
+
+api = Blueprint('api', __name__, cli_group=None)
 
 def create_initial_tasks():
     tasks = [
@@ -80,7 +47,8 @@ def create_initial_tasks():
         Task(description="Reach 10,000 balance", reward=2000, type="achievement", required_balance=10000),
         Task(description="Reach 50,000 balance", reward=10000, type="achievement", required_balance=50000)
     ]
-    db.session.bulk_save_objects(tasks)
+    db.session.add_all(tasks)
+    catalog.bump(db.session)
     db.session.commit()
 
 def create_initial_store_items():
@@ -95,334 +63,886 @@ def create_initial_store_items():
         StoreItem(id=8, name='Mega Miner', description='5x your mining speed', price=50000, currency='Balance', multiplier=5.0),
         StoreItem(id=9, name='Ultra Miner', description='10x your mining speed', price=100000, currency='Balance', multiplier=10.0),
     ]
-    db.session.bulk_save_objects(items)
+    db.session.add_all(items)
+    catalog.bump(db.session)
     db.session.commit()
 
-with app.app_context():
+def create_initial_cipher_puzzles():
+    db.session.add(CipherPuzzle(solution='CARBONITE'))
+    catalog.bump(db.session)
+    db.session.commit()
+
+def backfill_referral_counts():
+    referrals = select(func.count(Referral.id)).where(Referral.referrer_id == User.id).scalar_subquery()
+    db.session.execute(update(User).values(referral_count=referrals).execution_options(synchronize_session=False))
+    db.session.commit()
+
+def backfill_cipher_epochs():
+    # Users still locked out under the old next_cipher_time scheme solved
+    # today's cipher; everyone else may solve the current one
+    now = datetime.utcnow()
+    db.session.execute(
+        update(User)
+        .where(User.cipher_solved.is_(True), User.next_cipher_time > now)
+        .values(cipher_epoch=current_epoch(now))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+def backfill_user_items():
+    # Copies the comma-separated purchased_multipliers lists into UserItem
+    # rows, one INSERT ... SELECT for all users
+    owned = (',' + func.coalesce(User.purchased_multipliers, '') + ',').contains(
+        ',' + cast(StoreItem.id, db.String) + ','
+    )
+    db.session.execute(insert(UserItem).from_select(
+        ['user_id', 'item_id', 'purchased_at'],
+        select(User.id, StoreItem.id, literal(None, db.DateTime)).join(StoreItem, owned)
+    ))
+    db.session.commit()
+
+def start_mining_clocks():
+    # Users from before mining accrued start mining now. When the deploy
+    # changes MINING_DAILY_RATE, everyone's mining is first settled at the
+    # old rate and their clocks restarted, so a new rate never applies to
+    # time before it (turning mining on pays nothing for the time it was off).
+    now = datetime.utcnow()
+    db.session.execute(
+        update(User)
+        .where(User.last_earnings_update.is_(None))
+        .values(last_earnings_update=now)
+        .execution_options(synchronize_session=False)
+    )
+    current = db.session.get(MiningRate, 1)
+    previous = current.rate if current else 0.0
+    if previous != MINING_DAILY_RATE:
+        settled = BalanceLedger(db, User, mining_rate=previous).balance(now)
+        db.session.execute(
+            update(User)
+            .values(balance=settled, last_earnings_update=now)
+            .execution_options(synchronize_session=False)
+        )
+        if current:
+            current.rate = MINING_DAILY_RATE
+        else:
+            db.session.add(MiningRate(id=1, rate=MINING_DAILY_RATE))
+    db.session.commit()
+
+catalog = CatalogCache(db, CatalogVersion, StoreItem, Task, CipherPuzzle, check_interval=int(os.environ.get('CATALOG_CHECK_SECONDS', 5)))
+
+def init_db():
+    # Creates and upgrades the schema and seeds the catalog. Runs once per
+    # deploy (`flask --app app init-db`, or gunicorn's on_starting hook),
+    # not in every worker.
+    shards = shard_engines(db)
+    had_user_items = all(inspect(engine).has_table(UserItem.__tablename__) for _, engine in shards)
     db.create_all()
+    added_columns = upgrade_schema(db)
+    for name, engine in shards:
+        if name != MAIN:
+            db.metadata.create_all(engine, tables=[db.metadata.tables[table] for table in SHARDED_TABLES])
+            added_columns |= upgrade_schema(db, engine)
+    if ('user', 'referral_count') in added_columns:
+        backfill_referral_counts()
+    if ('user', 'cipher_epoch') in added_columns:
+        backfill_cipher_epochs()
+    start_mining_clocks()
+    # The old comma-separated lists only exist in unsharded databases
+    if not had_user_items and len(shards) == 1:
+        backfill_user_items()
     if Task.query.count() == 0:
         create_initial_tasks()
     if StoreItem.query.count() == 0:
         create_initial_store_items()
+    if CipherPuzzle.query.count() == 0:
+        create_initial_cipher_puzzles()
+
+@api.cli.command('init-db')
+def init_db_command():
+    init_db()
+    print("Database schema and catalog are up to date")
+
+CLAIM_AMOUNT = 3500
+CLAIM_INTERVAL = timedelta(hours=8)
+CIPHER_REWARD = 3000
+REFERRAL_BONUS = 2000
+TASK_CLAIM_COOLDOWN = timedelta(minutes=1)
+
+# MINING_DAILY_RATE - tokens a day every user mines at mining_multiplier 1,
+#                     settled lazily (see ledger.py). 0 (the default) turns
+#                     passive mining off, as before it existed, and the
+#                     store refuses Miner items. A changed rate applies from
+#                     the deploy that sets it (see start_mining_clocks).
+MINING_DAILY_RATE = float(os.environ.get('MINING_DAILY_RATE', 0))
+
+ledger = BalanceLedger(db, User, mining_rate=MINING_DAILY_RATE)
+LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 30))
+
+# Change counters shared by all workers, used as ETags for read endpoints:
+#   leaderboard          - bumped when a change touches the top LEADERBOARD_VERSION_DEPTH ranks,
+#                          including by a worker reloading its index
+#   store:<user_id>      - bumped when the user buys something
+#   referrals:<user_id>  - bumped when the user gains a referral
+versions = SharedCounters('versions')
+LEADERBOARD_VERSION_DEPTH = int(os.environ.get('LEADERBOARD_VERSION_DEPTH', 100))
+LEADERBOARD_MAX_AGE = int(os.environ.get('LEADERBOARD_MAX_AGE', 5))
+# Referral pages also show the referred users' balances, which change
+# without touching the referrer, so their ETag rolls over on this interval.
+REFERRALS_MAX_STALENESS = int(os.environ.get('REFERRALS_MAX_STALENESS', 60))
+
+def get_leaderboard_index(wait=True):
+    # Balances are loaded with everyone's unsettled mining as of one instant,
+    # so the ranking is consistent; between reloads it lags other users'
+    # mining by at most refresh_interval. Only the first load is paid for by
+    # a request, and only when `wait`; later ones run in the background
+    # (see Leaderboard.refresh).
+    app = current_app._get_current_object()
+
+    def fetch():
+        with app.app_context():
+            balance = ledger.balance(datetime.utcnow())
+            return db.session.query(User.id, User.user_id, User.username, balance).all()
+
+    leaderboard = app.extensions['leaderboard']
+    # A reload can bring in what track_balance never saw (mining drift,
+    # writes to users it had not loaded); cached pages revalidate when that
+    # changed the ranks they show
+    leaderboard.refresh(fetch, lambda: versions.incr('leaderboard'), wait=wait)
+    return leaderboard
+
+def top_balances(offset, limit):
+    # A leaderboard page read from the database while this worker's index
+    # is still loading: each shard returns only its top offset + limit rows,
+    # merged in index order
+    balance = ledger.balance(datetime.utcnow())
+    query = (
+        select(User.id, User.username, func.coalesce(balance, 0).label('balance'))
+        .order_by(func.coalesce(balance, 0).desc(), User.id)
+        .limit(offset + limit)
+    )
+    shards = [db.session.execute(query, bind_arguments=bind_arguments).all() for bind_arguments in each_shard(db)]
+    leaders = heapq.merge(*shards, key=lambda row: (-row.balance, row.id))
+    return [
+        {'rank': offset + i + 1, 'username': row.username, 'balance': row.balance}
+        for i, row in enumerate(islice(leaders, offset, offset + limit))
+    ]
 
-def generate_referral_code():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-
-@app.route('/api/user/check_and_create', methods=['POST'])
-def check_and_create_user():
-    data = request.json
-    app.logger.info(f"Received request to check/create user: {data}")
-
-    # Log the entire request data
-    app.logger.info(f"Full request data: {request.data}")
-
-    # Log headers to check for any Telegram-specific information
-    app.logger.info(f"Request headers: {request.headers}")
-
+def current_balance(user, pending=None):
+    # Settled balance plus unsettled mining and queued writes
+    balance = (user.balance or 0) + ledger.unsettled(user, datetime.utcnow())
+    return balance + pending.delta if pending else balance
+
+# Pushes balance, claim, task, purchase and leaderboard changes to the
+# /api/events streams of every worker. Streams are meant for the gevent
+# server in gunicorn.events.conf.py, where they cost no thread. Under
+# gthread an open stream holds a thread for up to EVENTS_MAX_DURATION, so
+# there only a quarter of a worker's threads may stream and the rest stay
+# free for API calls; clients turned away retry with backoff (see App.js).
+if os.environ.get('GUNICORN_WORKER_CLASS', 'gthread') == 'gevent':
+    DEFAULT_EVENTS_MAX_STREAMS = 1000
+else:
+    DEFAULT_EVENTS_MAX_STREAMS = max(1, worker_threads() // 4)
+EVENTS_HEARTBEAT_SECONDS = int(os.environ.get('EVENTS_HEARTBEAT_SECONDS', 15))
+EVENTS_MAX_DURATION = int(os.environ.get('EVENTS_MAX_DURATION', 300))
+
+def init_events(app):
+    # The leaderboard index and the event hub are per app, in app.extensions
+    leaderboard = Leaderboard(refresh_interval=LEADERBOARD_REFRESH_SECONDS, top_depth=LEADERBOARD_VERSION_DEPTH)
+    hub = EventHub(
+        max_queue=int(os.environ.get('EVENTS_MAX_QUEUE', 100)),
+        max_streams=int(os.environ.get('EVENTS_MAX_STREAMS', DEFAULT_EVENTS_MAX_STREAMS))
+    )
+
+    def apply_remote_event(event):
+        # Keep this worker's leaderboard index in step with balance changes
+        # made by the other workers
+        if event['type'] == 'balance':
+            data = event['data']
+            leaderboard.update(data['id'], event['user_id'], data['username'], data['balance'])
+
+    hub.remote_listeners.append(apply_remote_event)
+    app.extensions['leaderboard'] = leaderboard
+    app.extensions['event_hub'] = hub
+
+def event_hub():
+    return current_app.extensions['event_hub']
+
+def track_balance(user):
+    rank = current_app.extensions['leaderboard'].update(user.id, user.user_id, user.username, user.balance)
+    hub = event_hub()
+    hub.publish('balance', {'id': user.id, 'username': user.username, 'balance': user.balance}, user.user_id)
+    if rank is not None and rank <= LEADERBOARD_VERSION_DEPTH:
+        hub.publish('leaderboard', {'version': versions.incr('leaderboard')})
+
+def not_modified(etag, cache_control):
+    # Answers a conditional GET from the version counters alone, before the
+    # handler touches the database
+    if request.if_none_match.contains_weak(etag):
+        return cache_headers(Response(status=304), etag, cache_control)
+    return None
+
+def cache_headers(response, etag, cache_control):
+    if etag:
+        response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def flush_pending_writes(app, batch):
+    with app.app_context():
+        rows = []
+        try:
+            for user_id, write in batch.items():
+                row = ledger.apply(user_id, write.delta, floor=0, **write.values)
+                if not row:
+                    continue
+                for task_id, completed_at in write.tasks.items():
+                    updated = db.session.execute(
+                        update(UserTask)
+                        .where(UserTask.user_id == row.id, UserTask.task_id == task_id)
+                        .values(completed=True, completed_at=completed_at)
+                        .execution_options(synchronize_session=False)
+                    ).rowcount
+                    if not updated:
+                        db.session.add(UserTask(user_id=row.id, task_id=task_id, completed=True, completed_at=completed_at))
+                rows.append(row)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for row in rows:
+            track_balance(row)
+        current_app.logger.info("Flushed pending writes for %s users", len(batch))
+
+# YARA_WRITE_BEHIND=1 queues update_balance, update_user_wallet and task
+# completions in memory and commits them in batches instead of one commit
+# per request. Writes still queued when a worker dies without a clean
+# shutdown are lost, so it stays opt-in.
+def init_write_behind(app):
+    app.extensions['write_behind'] = None
+    if os.environ.get('YARA_WRITE_BEHIND') != '1':
+        return
+    write_behind = WriteBehind(
+        lambda batch: flush_pending_writes(app, batch),
+        interval_ms=int(os.environ.get('YARA_WRITE_BEHIND_INTERVAL_MS', 50)),
+        max_ops=int(os.environ.get('YARA_WRITE_BEHIND_MAX_OPS', 500)),
+        max_pending=int(os.environ.get('YARA_WRITE_BEHIND_MAX_PENDING', 10000))
+    )
+    atexit.register(write_behind.stop)
+    app.extensions['write_behind'] = write_behind
+
+def pending_writes():
+    # The app's write-behind queue, or None when it is off
+    return current_app.extensions.get('write_behind')
+
+def load_user(user_id):
+    # Returns the user together with any writes still queued for it
+    write_behind = pending_writes()
+    if not write_behind:
+        return User.query.filter_by(user_id=user_id).first(), None
+    return write_behind.snapshot(user_id, lambda: User.query.filter_by(user_id=user_id).first())
+
+def settle_pending_writes(user_id):
+    write_behind = pending_writes()
+    if write_behind:
+        write_behind.flush_user(user_id)
+
+@api.app_errorhandler(WriteBehindFull)
+def handle_write_behind_full(error):
+    current_app.logger.warning("Write-behind queue is full, rejecting request")
+    return jsonify({'error': 'Server busy, please retry'}), 503
+
+def finish_verification(app, job_id, status, context):
+    # Runs on a verification thread once the provider has answered
+    if status == VERIFIED:
+        with app.app_context():
+            user, _ = load_user(context['user_id'])
+            task = catalog.task(context['task_id'])
+            if user and task:
+                mark_task_completed(user, task)
+    app.extensions['event_hub'].publish('verification', {'job_id': job_id, 'task_id': context['task_id'], 'status': status}, context['user_id'])
+
+# Telegram and Twitter checks run on per-provider thread pools; verify_task
+# answers 202 with a job id that the client polls at /api/verify_task/<job_id>
+# or waits for as a 'verification' event. A provider without configuration
+# keeps the old accept-everything behavior.
+def init_verification(app):
+    options = {'timeout': float(os.environ.get('VERIFY_TIMEOUT_SECONDS', 10))}
+    providers = {}
+    if os.environ.get('TELEGRAM_BOT_TOKEN'):
+        providers['telegram'] = telegram_provider(
+            os.environ['TELEGRAM_BOT_TOKEN'],
+            os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org'),
+            concurrency=int(os.environ.get('TELEGRAM_VERIFY_CONCURRENCY', 8)),
+            **options
+        )
+    if os.environ.get('TWITTER_FOLLOW_CHECK_URL'):
+        providers['twitter'] = twitter_provider(
+            os.environ['TWITTER_FOLLOW_CHECK_URL'],
+            os.environ.get('TWITTER_BEARER_TOKEN'),
+            concurrency=int(os.environ.get('TWITTER_VERIFY_CONCURRENCY', 4)),
+            **options
+        )
+    app.extensions['verifier'] = VerificationPipeline(
+        providers,
+        lambda job_id, status, context: finish_verification(app, job_id, status, context),
+        cache_ttl=int(os.environ.get('VERIFY_CACHE_SECONDS', 600)),
+        failure_ttl=int(os.environ.get('VERIFY_FAILURE_CACHE_SECONDS', 30))
+    )
+
+referral_codes = ReferralCodes(
+    db, Sequence,
+    block_size=int(os.environ.get('REFERRAL_CODE_BLOCK_SIZE', 100)),
+    cache_size=int(os.environ.get('REFERRAL_CODE_CACHE_SIZE', 100000))
+)
+
+# Ids for new users when the user tables are sharded (see sharding.py)
+user_ids = SequenceBlocks(db, Sequence, 'user_id', block_size=int(os.environ.get('USER_ID_BLOCK_SIZE', 100)))
+
+def get_or_create_user(data):
     user = User.query.filter_by(user_id=data['user_id']).first()
 
     if not user:
         referral_code = data.get('referral_code')
-        app.logger.info(f"Referral code received in request: {referral_code}")
+        current_app.logger.info("Referral code received in request: %s", referral_code)
 
         # Log the start parameter separately if it's coming from Telegram
         start_param = data.get('start_param')
-        app.logger.info(f"Start parameter from Telegram: {start_param}")
+        current_app.logger.info("Start parameter from Telegram: %s", start_param)
 
         referrer = None
         if referral_code:
-            referrer = User.query.filter_by(referral_code=referral_code).first()
-            app.logger.info(f"Found referrer: {referrer.username if referrer else 'None'}")
+            referrer = referral_codes.resolve(
+                referral_code, lambda code: User.query.filter_by(referral_code=code).first()
+            )
+            current_app.logger.info("Found referrer: %s", referrer.username if referrer else 'None')
 
         new_user = User(
+            id=allocate_user_id(user_ids, data['user_id']),
             user_id=data['user_id'],
             username=data['username'],
-            referral_code=generate_referral_code()
+            referral_code=referral_codes.allocate(),
+            referred_by=referrer.id if referrer else None
         )
         db.session.add(new_user)
-        db.session.flush()
-        app.logger.info(f"Created new user: {new_user.username} with referral code: {new_user.referral_code}")
-
-        if referrer:
-            try:
-                referrer.balance += 2000  # Bonus for referrer
-                new_referral = Referral(referrer_id=referrer.id, referred_id=new_user.id)
-                db.session.add(new_referral)
-                app.logger.info(f"Created new referral relationship: {referrer.username} referred {new_user.username}")
-            except Exception as e:
-                app.logger.error(f"Failed to create referral relationship: {str(e)}")
-                db.session.rollback()
-                return jsonify({'error': 'Failed to create referral relationship'}), 500
-
         try:
             db.session.commit()
-            app.logger.info(f"Successfully committed new user and referral data")
+            current_app.logger.info("Created new user: %s with referral code: %s", new_user.username, new_user.referral_code)
         except Exception as e:
-            app.logger.error(f"Failed to commit new user data: {str(e)}")
+            current_app.logger.error("Failed to commit new user data: %s", e)
             db.session.rollback()
-            return jsonify({'error': 'Failed to create user'}), 500
+            return None, (jsonify({'error': 'Failed to create user'}), 500)
+
+        referral_codes.remember(new_user)
+        track_balance(new_user)
+        if referrer:
+            credit_referral(new_user, referrer)
 
         user = new_user
     else:
-        app.logger.info(f"Found existing user: {user.username}")
+        current_app.logger.info("Found existing user: %s", user.username)
+        if user.referred_by is not None:
+            credit_referral(user)
+
+    return user, None
+
+def credit_referral(user, referrer=None):
+    # The referral row and bonus live on the referrer's shard and are
+    # committed after the new user's own shard. user.referred_by stays set
+    # until they are, and the Referral insert is keyed on the referred user,
+    # so a failure here is retried by the user's next lookup without ever
+    # crediting twice.
+    try:
+        referrer = referrer or User.query.filter_by(id=user.referred_by).first()
+        referrer_row = None
+        if referrer:
+            inserted = db.session.execute(insert(Referral).from_select(
+                ['referrer_id', 'referred_id'],
+                select(literal(referrer.id), literal(user.id)).where(~exists().where(
+                    Referral.referrer_id == referrer.id, Referral.referred_id == user.id
+                ))
+            ).returning(Referral.id)).first()
+            if inserted:
+                # Bonus for referrer, counted in the same statement
+                referrer_row = ledger.apply(referrer.user_id, REFERRAL_BONUS, referral_count=User.referral_count + 1)
+            db.session.commit()
+            if inserted:
+                current_app.logger.info("Created new referral relationship: %s referred %s", referrer.username, user.username)
+        db.session.execute(
+            update(User).where(User.id == user.id).values(referred_by=None).execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception as e:
+        current_app.logger.error("Failed to credit referral of %s, will retry: %s", user.user_id, e)
+        db.session.rollback()
+        return
+    if referrer_row:
+        track_balance(referrer_row)
+        versions.incr(f"referrals:{referrer_row.user_id}")
+
+@api.route('/api/user/check_and_create', methods=['POST'])
+def check_and_create_user():
+    data = request.json
+    current_app.logger.info("Received request to check/create user: %s", data['user_id'])
+
+    # Log the entire request, including headers to check for any
+    # Telegram-specific information
+    log_payload(current_app.logger, "Check/create user request", lambda: {
+        'data': request.get_data(as_text=True),
+        'headers': dict(request.headers)
+    })
+
+    user, error = get_or_create_user(data)
+    if error:
+        return error
 
     response_data = {
         'user_id': user.user_id,
         'username': user.username,
-        'balance': user.balance,
+        'balance': current_balance(user),
         'last_claim': user.last_claim.isoformat() if user.last_claim else None,
-        'cipher_solved': user.cipher_solved,
-        'next_cipher_time': user.next_cipher_time.isoformat() if user.next_cipher_time else None,
+        **cipher_state(user, datetime.utcnow()),
         'referral_link': f"https://t.me/yara_miner_bot/mine65?start={user.referral_code}"
     }
-    app.logger.info(f"Sending response: {response_data}")
+    log_payload(current_app.logger, "Sending check/create user response", response_data)
 
     return jsonify(response_data)
 
 
-@app.route('/api/user/<user_id>', methods=['GET'])
+BOOTSTRAP_FIELDS = ('user', 'tasks', 'store_items', 'leaderboard', 'referrals')
+
+@api.route('/api/bootstrap', methods=['POST'])
+def bootstrap():
+    # Everything the Mini App needs when it opens, in one request: the user
+    # is created or looked up once and every section reuses it. `fields`
+    # (query string, comma separated) limits the response to some sections.
+    data = request.json
+    fields = request.args.get('fields')
+    fields = set(fields.split(',')) & set(BOOTSTRAP_FIELDS) if fields else set(BOOTSTRAP_FIELDS)
+    current_app.logger.info("Bootstrap request for user_id: %s, fields: %s", data['user_id'], sorted(fields))
+
+    # The user, their task rows and their queued writes are read in one
+    # write-behind snapshot, so a flush in between cannot count a delta twice
+    def load():
+        user = User.query.filter_by(user_id=data['user_id']).first()
+        user_tasks = UserTask.query.filter_by(user_id=user.id).all() if user and 'tasks' in fields else []
+        return user, user_tasks
+
+    write_behind = pending_writes()
+    (user, user_tasks), pending = write_behind.snapshot(data['user_id'], load) if write_behind else (load(), None)
+    if not user:
+        user, error = get_or_create_user(data)
+        if error:
+            return error
+    elif user.referred_by is not None:
+        credit_referral(user)
+    referral_link = f"https://t.me/yara_miner_bot/mine65?start={user.referral_code}"
+
+    response_data = {}
+    if 'user' in fields:
+        response_data['user'] = {
+            'user_id': user.user_id,
+            'username': user.username,
+            'balance': current_balance(user, pending),
+            'mining_rate': ledger.daily_rate(user),
+            'last_claim': user.last_claim.isoformat() if user.last_claim else None,
+            **cipher_state(user, datetime.utcnow()),
+            'wallet_address': pending.values.get('wallet_address', user.wallet_address) if pending else user.wallet_address,
+            'balance_multiplier': user.balance_multiplier,
+            'mining_multiplier': user.mining_multiplier,
+            'last_purchase_time': user.last_ton_purchase.isoformat() if user.last_ton_purchase else None,
+            'referral_link': referral_link
+        }
+    if 'tasks' in fields:
+        response_data['tasks'] = build_task_list(user_tasks, pending)
+    if 'store_items' in fields:
+        response_data['store_items'] = catalog.store_items_with(purchase_checker(user))
+    if 'leaderboard' in fields:
+        index = get_leaderboard_index()
+        entry = index.rank(user.user_id)
+        response_data['leaderboard'] = {
+            'top': [{
+                'rank': leader['rank'],
+                'username': leader['username'],
+                'balance': leader['balance']
+            } for leader in index.page(0, 10)],
+            'rank': entry['rank'] if entry else None,
+            'total': len(index)
+        }
+    if 'referrals' in fields:
+        response_data['referrals'] = {
+            'referral_code': user.referral_code,
+            'referral_link': referral_link,
+            'referral_count': user.referral_count
+        }
+
+    return jsonify(response_data)
+
+@api.before_app_request
+def start_event_hub():
+    event_hub().ensure_started()
+
+@api.route('/api/events/<user_id>', methods=['GET'])
+def user_events(user_id):
+    # Server-Sent Events stream of the user's balance, claim, task and
+    # purchase changes plus leaderboard updates
+    hub = event_hub()
+    subscriber = hub.subscribe(user_id)
+    if not subscriber:
+        current_app.logger.warning("Too many event streams, rejecting user_id: %s", user_id)
+        return jsonify({'error': 'Too many event streams, please retry'}), 503, {'Retry-After': '60'}
+    current_app.logger.info("Opening event stream for user_id: %s", user_id)
+    response = Response(
+        stream(hub, subscriber, heartbeat=EVENTS_HEARTBEAT_SECONDS, max_duration=EVENTS_MAX_DURATION),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@api.route('/api/user/<user_id>', methods=['GET'])
 def get_user(user_id):
-    app.logger.info(f"Fetching user data for user_id: {user_id}")
-    user = User.query.filter_by(user_id=user_id).first()
+    current_app.logger.info("Fetching user data for user_id: %s", user_id)
+    user, pending = load_user(user_id)
     if user:
-        app.logger.info(f"User found: {user.username}")
+        current_app.logger.info("User found: %s", user.username)
         return jsonify({
             'user_id': user.user_id,
             'username': user.username,
-            'balance': user.balance,
+            'balance': current_balance(user, pending),
+            'mining_rate': ledger.daily_rate(user),
             'last_claim': user.last_claim.isoformat() if user.last_claim else None,
-            'cipher_solved': user.cipher_solved,
-            'next_cipher_time': user.next_cipher_time.isoformat() if user.next_cipher_time else None,
-            'wallet_address': user.wallet_address
+            **cipher_state(user, datetime.utcnow()),
+            'wallet_address': pending.values.get('wallet_address', user.wallet_address) if pending else user.wallet_address
         })
-    app.logger.warning(f"User not found for user_id: {user_id}")
+    current_app.logger.warning("User not found for user_id: %s", user_id)
     return jsonify({'error': 'User not found'}), 404
 
-@app.route('/api/claim', methods=['POST'])
+@api.route('/api/claim', methods=['POST'])
 def claim_tokens():
     data = request.json
-    app.logger.info(f"Claim request received for user_id: {data['user_id']}")
+    current_app.logger.info("Claim request received for user_id: %s", data['user_id'])
+    settle_pending_writes(data['user_id'])
+    now = datetime.utcnow()
+    row = ledger.apply(
+        data['user_id'],
+        CLAIM_AMOUNT * func.coalesce(User.balance_multiplier, 1),
+        or_(User.last_claim.is_(None), User.last_claim <= now - CLAIM_INTERVAL),
+        last_claim=now
+    )
+    if row:
+        db.session.commit()
+        track_balance(row)
+        balance_multiplier = row.balance_multiplier if row.balance_multiplier is not None else 1
+        claim_amount = CLAIM_AMOUNT * balance_multiplier
+        event_hub().publish('claim', {
+            'claimed_amount': claim_amount,
+            'last_claim': now.isoformat(),
+            'next_claim_time': (now + CLAIM_INTERVAL).isoformat()
+        }, row.user_id)
+        current_app.logger.info("Claim successful for %s. New balance: %s", row.username, row.balance)
+        return jsonify({'success': True, 'new_balance': row.balance, 'claimed_amount': claim_amount})
+
     user = User.query.filter_by(user_id=data['user_id']).first()
     if user:
-        if user.last_claim is None or datetime.utcnow() - user.last_claim >= timedelta(hours=8):
-            base_claim_amount = 3500
-            # Add this check
-            balance_multiplier = user.balance_multiplier if user.balance_multiplier is not None else 1
-            claim_amount = base_claim_amount * balance_multiplier
-            user.balance += claim_amount
-            user.last_claim = datetime.utcnow()
-            db.session.commit()
-            app.logger.info(f"Claim successful for {user.username}. New balance: {user.balance}")
-            return jsonify({'success': True, 'new_balance': user.balance, 'claimed_amount': claim_amount})
-        else:
-            app.logger.info(f"Claim attempt too soon for {user.username}")
-            return jsonify({'error': 'Cannot claim yet'}), 400
-    app.logger.warning(f"User not found for claim request: {data['user_id']}")
+        current_app.logger.info("Claim attempt too soon for %s", user.username)
+        return jsonify({'error': 'Cannot claim yet'}), 400
+    current_app.logger.warning("User not found for claim request: %s", data['user_id'])
     return jsonify({'error': 'User not found'}), 404
 
-@app.route('/api/user/<user_id>/last_purchase_time', methods=['GET'])
+@api.route('/api/user/<user_id>/last_purchase_time', methods=['GET'])
 def get_last_purchase_time(user_id):
-    app.logger.info(f"Fetching last purchase time for user_id: {user_id}")
+    current_app.logger.info("Fetching last purchase time for user_id: %s", user_id)
     user = User.query.filter_by(user_id=user_id).first()
     if user:
         return jsonify({
             'last_purchase_time': user.last_ton_purchase.isoformat() if user.last_ton_purchase else None
         })
-    app.logger.warning(f"User not found for user_id: {user_id}")
+    current_app.logger.warning("User not found for user_id: %s", user_id)
     return jsonify({'error': 'User not found'}), 404
 
-@app.route('/api/update_multiplier', methods=['POST'])
+@api.route('/api/update_multiplier', methods=['POST'])
 def update_multiplier():
     data = request.json
     user_id = data.get('user_id')
     multiplier = data.get('multiplier')
 
-    app.logger.info(f"Updating multiplier for user_id: {user_id}, multiplier: {multiplier}")
+    current_app.logger.info("Updating multiplier for user_id: %s, multiplier: %s", user_id, multiplier)
 
     user = User.query.filter_by(user_id=user_id).first()
     if not user:
-        app.logger.warning(f"User not found for user_id: {user_id}")
+        current_app.logger.warning("User not found for user_id: %s", user_id)
         return jsonify({'error': 'User not found'}), 404
 
     user.balance_multiplier = multiplier
     user.last_ton_purchase = datetime.utcnow()
     db.session.commit()
 
-    app.logger.info(f"Multiplier updated for {user.username}. New multiplier: {user.balance_multiplier}")
+    current_app.logger.info("Multiplier updated for %s. New multiplier: %s", user.username, user.balance_multiplier)
     return jsonify({'success': True, 'new_multiplier': user.balance_multiplier})
 
-@app.route('/api/purchase', methods=['POST'])
+@api.route('/api/purchase', methods=['POST'])
 def purchase():
     data = request.json
     user_id = data.get('user_id')
     item_id = data.get('item_id')
 
-    app.logger.info(f"Purchase request for user_id: {user_id}, item_id: {item_id}")
-
-    user = User.query.filter_by(user_id=user_id).first()
-    if not user:
-        app.logger.warning(f"User not found for user_id: {user_id}")
-        return jsonify({'error': 'User not found'}), 404
+    current_app.logger.info("Purchase request for user_id: %s, item_id: %s", user_id, item_id)
 
-    item = StoreItem.query.get(item_id)
+    item = catalog.store_item(item_id)
     if not item:
-        app.logger.warning(f"Item not found for item_id: {item_id}")
+        current_app.logger.warning("Item not found for item_id: %s", item_id)
         return jsonify({'error': 'Item not found'}), 404
 
-    if item.currency == 'Balance':
-        if user.balance < item.price:
-            app.logger.warning(f"Insufficient balance for user: {user.username}")
-            return jsonify({'error': 'Insufficient balance'}), 400
-
-        # Check if the user has already purchased this multiplier
-        purchased_multipliers = user.purchased_multipliers.split(',') if user.purchased_multipliers else []
-        if str(item.id) in purchased_multipliers:
-            app.logger.warning(f"User {user.username} already purchased multiplier: {item.id}")
-            return jsonify({'error': 'Multiplier already purchased'}), 400
+    if item.currency == 'Balance' and not ledger.mining_rate:
+        # Miner items only raise the mining rate, which is zero
+        current_app.logger.warning("Mining is off, refusing item: %s", item.id)
+        return jsonify({'error': 'Mining is not available'}), 400
 
-        user.balance -= item.price
-        user.mining_multiplier = item.multiplier
-
-        # Add the purchased multiplier to the user's list
-        purchased_multipliers.append(str(item.id))
-        user.purchased_multipliers = ','.join(purchased_multipliers)
+    settle_pending_writes(user_id)
+    now = datetime.utcnow()
+    if item.currency == 'Balance':
+        already_purchased = exists().where(UserItem.user_id == User.id, UserItem.item_id == item.id)
+        row = ledger.apply(
+            user_id,
+            -item.price,
+            ledger.balance(now) >= item.price,
+            ~already_purchased,
+            now=now,
+            mining_multiplier=item.multiplier
+        )
+        if row:
+            try:
+                # The unique (user_id, item_id) index backs up the check above
+                db.session.add(UserItem(user_id=row.id, item_id=item.id, purchased_at=now))
+                db.session.flush()
+            except IntegrityError:
+                db.session.rollback()
+                row = None
     elif item.currency == 'TON':
-        user.balance_multiplier = item.multiplier
-        user.last_ton_purchase = datetime.utcnow()
+        row = ledger.apply(user_id, 0, balance_multiplier=item.multiplier, last_ton_purchase=datetime.utcnow())
     else:
-        app.logger.warning(f"Invalid currency for item: {item.id}")
+        current_app.logger.warning("Invalid currency for item: %s", item.id)
         return jsonify({'error': 'Invalid item currency'}), 400
 
-    db.session.commit()
+    if not row:
+        user = User.query.filter_by(user_id=user_id).first()
+        if not user:
+            current_app.logger.warning("User not found for user_id: %s", user_id)
+            return jsonify({'error': 'User not found'}), 404
+        if current_balance(user) < item.price:
+            current_app.logger.warning("Insufficient balance for user: %s", user.username)
+            return jsonify({'error': 'Insufficient balance'}), 400
+        current_app.logger.warning("User %s already purchased multiplier: %s", user.username, item.id)
+        return jsonify({'error': 'Multiplier already purchased'}), 400
 
-    app.logger.info(f"Purchase successful for {user.username}. New balance: {user.balance}, New mining multiplier: {user.mining_multiplier}")
+    db.session.commit()
+    track_balance(row)
+    versions.incr(f"store:{user_id}")
+    event_hub().publish('purchase', {
+        'item_id': item.id,
+        'new_mining_multiplier': row.mining_multiplier,
+        'new_balance_multiplier': row.balance_multiplier
+    }, row.user_id)
+
+    current_app.logger.info("Purchase successful for %s. New balance: %s, New mining multiplier: %s", row.username, row.balance, row.mining_multiplier)
     return jsonify({
         'success': True,
-        'new_balance': user.balance,
-        'new_mining_multiplier': user.mining_multiplier,
-        'new_balance_multiplier': user.balance_multiplier
+        'new_balance': row.balance,
+        'new_mining_multiplier': row.mining_multiplier,
+        'new_balance_multiplier': row.balance_multiplier
     })
 
-@app.route('/api/store/items', methods=['GET'])
+def purchase_checker(user):
+    owned = set(db.session.execute(select(UserItem.item_id).where(UserItem.user_id == user.id)).scalars()) if user else set()
+    return lambda item: item.id in owned if item.currency == 'Balance' else False
+
+@api.route('/api/store/items', methods=['GET'])
 def get_store_items():
-    app.logger.info("Fetching store items")
+    current_app.logger.info("Fetching store items")
     user_id = request.args.get('user_id')
-    user = User.query.filter_by(user_id=user_id).first()
+    etag = f"store-{versions.epoch}-{catalog.version}-{versions.get(f'store:{user_id}')}"
+    cached = not_modified(etag, 'private, no-cache')
+    if cached:
+        return cached
 
-    items = StoreItem.query.all()
-    purchased_multipliers = user.purchased_multipliers.split(',') if user and user.purchased_multipliers else []
-
-    return jsonify([{
-        'id': item.id,
-        'name': item.name,
-        'description': item.description,
-        'price': item.price,
-        'currency': item.currency,
-        'multiplier': item.multiplier,
-        'purchased': str(item.id) in purchased_multipliers if item.currency == 'Balance' else False
-    } for item in items])
+    user = User.query.filter_by(user_id=user_id).first()
+    response = Response(catalog.store_items_json(purchase_checker(user)), mimetype='application/json')
+    return cache_headers(response, etag, 'private, no-cache')
 
-@app.route('/api/user/update_wallet', methods=['POST'])
+@api.route('/api/user/update_wallet', methods=['POST'])
 def update_user_wallet():
     data = request.json
     user_id = data.get('user_id')
     wallet_address = data.get('wallet_address')
 
-    app.logger.info(f"Updating wallet address for user_id: {user_id}")
+    current_app.logger.info("Updating wallet address for user_id: %s", user_id)
 
     user = User.query.filter_by(user_id=user_id).first()
     if user:
-        user.wallet_address = wallet_address
-        db.session.commit()
-        app.logger.info(f"Wallet address updated for {user.username}")
+        write_behind = pending_writes()
+        if write_behind:
+            write_behind.add(user_id, values={'wallet_address': wallet_address})
+        else:
+            user.wallet_address = wallet_address
+            db.session.commit()
+        current_app.logger.info("Wallet address updated for %s", user.username)
         return jsonify({'success': True})
 
-    app.logger.warning(f"User not found for wallet update: {user_id}")
+    current_app.logger.warning("User not found for wallet update: %s", user_id)
     return jsonify({'error': 'User not found'}), 404
 
-@app.route('/api/update_balance', methods=['POST'])
+@api.route('/api/update_balance', methods=['POST'])
 def update_balance():
     data = request.json
     user_id = data.get('user_id')
     amount = data.get('amount')
 
-    app.logger.info(f"Balance update request for user_id: {user_id}, amount: {amount}")
+    current_app.logger.info("Balance update request for user_id: %s, amount: %s", user_id, amount)
 
     if not user_id or amount is None:
-        app.logger.warning("Missing user_id or amount in balance update request")
+        current_app.logger.warning("Missing user_id or amount in balance update request")
         return jsonify({'error': 'Missing user_id or amount'}), 400
 
-    user = User.query.filter_by(user_id=user_id).first()
-    if not user:
-        app.logger.warning(f"User not found for balance update: {user_id}")
-        return jsonify({'error': 'User not found'}), 404
-
     try:
         amount = float(amount)
     except ValueError:
-        app.logger.warning(f"Invalid amount for balance update: {amount}")
+        current_app.logger.warning("Invalid amount for balance update: %s", amount)
         return jsonify({'error': 'Invalid amount'}), 400
 
-    user.balance += amount
-    if user.balance < 0:
-        user.balance = 0  # Ensure balance doesn't go negative
+    write_behind = pending_writes()
+    if write_behind:
+        user, pending = load_user(user_id)
+        if not user:
+            current_app.logger.warning("User not found for balance update: %s", user_id)
+            return jsonify({'error': 'User not found'}), 404
+        balance = current_balance(user, pending)
+        new_balance = max(balance + amount, 0.0)  # Ensure balance doesn't go negative
+        write_behind.add(user_id, delta=new_balance - balance)
+        current_app.logger.info("Balance update queued for %s. New balance: %s", user.username, new_balance)
+        return jsonify({
+            'success': True,
+            'new_balance': new_balance
+        })
+
+    # Ensure balance doesn't go negative
+    row = ledger.apply(user_id, amount, floor=0)
+    if not row:
+        current_app.logger.warning("User not found for balance update: %s", user_id)
+        return jsonify({'error': 'User not found'}), 404
 
     db.session.commit()
-    app.logger.info(f"Balance updated for {user.username}. New balance: {user.balance}")
+    track_balance(row)
+    current_app.logger.info("Balance updated for %s. New balance: %s", row.username, row.balance)
 
     return jsonify({
         'success': True,
-        'new_balance': user.balance
+        'new_balance': row.balance
+    })
+
+@api.route('/api/cipher', methods=['GET'])
+def get_cipher():
+    # Today's puzzle without its answer, for sizing the input boxes
+    now = datetime.utcnow()
+    epoch = current_epoch(now)
+    puzzle = puzzle_for(epoch, catalog.puzzles())
+    if not puzzle:
+        return jsonify({'error': 'No cipher available'}), 404
+    return jsonify({
+        'length': len(puzzle.solution),
+        'hint': puzzle.hint,
+        'reward': CIPHER_REWARD,
+        'next_reset': next_reset(epoch).isoformat()
     })
 
-@app.route('/api/solve_cipher', methods=['POST'])
+@api.route('/api/solve_cipher', methods=['POST'])
 def solve_cipher():
     data = request.json
-    app.logger.info(f"Cipher solve attempt for user_id: {data['user_id']}")
+    current_app.logger.info("Cipher solve attempt for user_id: %s", data['user_id'])
+    settle_pending_writes(data['user_id'])
+    epoch = current_epoch(datetime.utcnow())
+    puzzle = puzzle_for(epoch, catalog.puzzles())
+    if puzzle and data['solution'].upper() == puzzle.solution.upper():
+        row = ledger.apply(
+            data['user_id'],
+            CIPHER_REWARD,
+            or_(User.cipher_epoch.is_(None), User.cipher_epoch != epoch),
+            cipher_epoch=epoch
+        )
+        if row:
+            db.session.commit()
+            track_balance(row)
+            current_app.logger.info("Cipher solved successfully by %s. New balance: %s", row.username, row.balance)
+            return jsonify({
+                'success': True,
+                'new_balance': row.balance,
+                'next_cipher_time': next_reset(epoch).isoformat()
+            })
+
     user = User.query.filter_by(user_id=data['user_id']).first()
     if user:
-        if not user.cipher_solved and (user.next_cipher_time is None or datetime.utcnow() >= user.next_cipher_time):
-            if data['solution'].upper() == 'CARBONITE':
-                reward_amount = 3000
-                user.balance += reward_amount
-                user.cipher_solved = True
-                next_time = datetime.utcnow().replace(hour=12, minute=0, second=0, microsecond=0)
-                if next_time <= datetime.utcnow():
-                    next_time += timedelta(days=1)
-                user.next_cipher_time = next_time
-                db.session.commit()
-                app.logger.info(f"Cipher solved successfully by {user.username}. New balance: {user.balance}")
-                return jsonify({'success': True, 'new_balance': user.balance})
-            else:
-                app.logger.info(f"Incorrect cipher solution by {user.username}")
-                return jsonify({'error': 'Incorrect solution'}), 400
+        if puzzle and user.cipher_epoch != epoch:
+            current_app.logger.info("Incorrect cipher solution by %s", user.username)
+            return jsonify({'error': 'Incorrect solution'}), 400
         else:
-            app.logger.info(f"Cipher already solved or not available for {user.username}")
+            current_app.logger.info("Cipher already solved or not available for %s", user.username)
             return jsonify({'error': 'Cipher already solved or not available'}), 400
-    app.logger.warning(f"User not found for cipher solve attempt: {data['user_id']}")
+    current_app.logger.warning("User not found for cipher solve attempt: %s", data['user_id'])
     return jsonify({'error': 'User not found'}), 404
 
-@app.route('/api/leaderboard', methods=['GET'])
+@api.route('/api/leaderboard', methods=['GET'])
 def get_leaderboard():
-    app.logger.info("Fetching leaderboard")
-    leaders = User.query.order_by(User.balance.desc()).limit(10).all()
-    leaderboard = [{'username': leader.username, 'balance': leader.balance} for leader in leaders]
-    app.logger.info(f"Leaderboard fetched: {leaderboard}")
-    return jsonify(leaderboard)
-
-@app.route('/api/tasks', methods=['GET'])
-def get_tasks():
-    user_id = request.args.get('user_id')
-    user = User.query.filter_by(user_id=user_id).first()
-    if not user:
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    current_app.logger.info("Fetching leaderboard offset: %s, limit: %s", offset, limit)
+    cache_control = f"public, max-age={LEADERBOARD_MAX_AGE}"
+    # Reload a stale index first: its version bump belongs in the ETag.
+    # A worker's first load runs in the background; pages are read from
+    # the shards until it is done.
+    index = get_leaderboard_index(wait=False)
+    # Only the ranks covered by the shared version have a usable ETag
+    etag = None
+    if offset + limit <= LEADERBOARD_VERSION_DEPTH:
+        etag = f"lb-{versions.epoch}-{versions.get('leaderboard')}-{offset}-{limit}"
+        cached = not_modified(etag, cache_control)
+        if cached:
+            return cached
+
+    leaders = index.page(offset, limit) if index.loaded() else top_balances(offset, limit)
+    response = jsonify([{
+        'rank': leader['rank'],
+        'username': leader['username'],
+        'balance': leader['balance']
+    } for leader in leaders])
+    return cache_headers(response, etag, cache_control)
+
+@api.route('/api/leaderboard/rank/<user_id>', methods=['GET'])
+def get_leaderboard_rank(user_id):
+    current_app.logger.info("Fetching leaderboard rank for user_id: %s", user_id)
+    index = get_leaderboard_index()
+    entry = index.rank(user_id)
+    if not entry:
+        current_app.logger.warning("User not ranked for user_id: %s", user_id)
         return jsonify({'error': 'User not found'}), 404
+    return jsonify({
+        'rank': entry['rank'],
+        'username': entry['username'],
+        'balance': entry['balance'],
+        'total': len(index)
+    })
 
-    all_tasks = Task.query.all()
-    user_tasks = UserTask.query.filter_by(user_id=user.id).all()
+def build_task_list(user_task_rows, pending, task_type=None):
+    user_tasks = {}
+    for row in user_task_rows:
+        user_tasks.setdefault(row.task_id, row)
+    now = datetime.utcnow()
 
     tasks = []
-    for task in all_tasks:
-        user_task = next((ut for ut in user_tasks if ut.task_id == task.id), None)
+    for task in catalog.tasks():
+        if task_type and task.type != task_type:
+            continue
+        if pending and task.id in pending.tasks:
+            continue
+        user_task = user_tasks.get(task.id)
         if not user_task or not user_task.completed:
             tasks.append({
                 'id': task.id,
@@ -431,56 +951,82 @@ def get_tasks():
                 'type': task.type,
                 'completed': user_task.completed if user_task else False,
                 'claimed': user_task.claimed if user_task else False,
-                'cooldown': (user_task.completed_at + timedelta(minutes=1) - datetime.utcnow()).total_seconds() if user_task and user_task.completed_at else 0
+                'cooldown': (user_task.completed_at + TASK_CLAIM_COOLDOWN - now).total_seconds() if user_task and user_task.completed_at else 0
             })
-    app.logger.info(f"Returning tasks: {tasks}")
-    return jsonify(tasks)
+    return tasks
 
-@app.route('/api/verify_task', methods=['POST'])
+@api.route('/api/tasks', methods=['GET'])
+def get_tasks():
+    user_id = request.args.get('user_id')
+    task_type = request.args.get('type')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    # Without a limit every task is returned, as before paging
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = min(max(limit, 1), 100)
+
+    # One round trip for the user and all of their task rows; a user without
+    # any UserTask rows still comes back as a single row of NULLs. Read in
+    # the same write-behind snapshot as the user's queued task updates.
+    def load():
+        return db.session.execute(
+            select(User.id, UserTask.task_id, UserTask.completed, UserTask.claimed, UserTask.completed_at)
+            .outerjoin(UserTask, UserTask.user_id == User.id)
+            .where(User.user_id == user_id)
+        ).all()
+
+    write_behind = pending_writes()
+    rows, pending = write_behind.snapshot(user_id, load) if write_behind else (load(), None)
+    if not rows:
+        return jsonify({'error': 'User not found'}), 404
+
+    tasks = build_task_list([row for row in rows if row.task_id is not None], pending, task_type)
+
+    total = len(tasks)
+    tasks = tasks[offset:offset + limit] if limit else tasks[offset:]
+    current_app.logger.info("Returning %s of %s tasks for user_id: %s", len(tasks), total, user_id)
+    log_payload(current_app.logger, "Returning tasks", tasks)
+    response = jsonify(tasks)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+@api.route('/api/verify_task', methods=['POST'])
 def verify_task():
     data = request.json
     user_id = data.get('user_id')
     task_id = data.get('task_id')
 
-    user = User.query.filter_by(user_id=user_id).first()
+    user, pending = load_user(user_id)
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    task = Task.query.get(task_id)
+    task = catalog.task(task_id)
     if not task:
         return jsonify({'error': 'Task not found'}), 404
 
     if task.type == 'referral':
-        referral_count = Referral.query.filter_by(referrer_id=user.id).count()
-        if referral_count >= task.required_count:
+        if user.referral_count >= task.required_count:
             return complete_task(user, task)
         else:
             return jsonify({'error': 'Not enough referrals'}), 400
 
     elif task.type == 'telegram':
-        # Implement Telegram channel membership verification
         telegram_username = data.get('telegram_username')
         if not telegram_username:
             return jsonify({'error': 'Telegram username not provided'}), 400
 
-        if verify_telegram_membership(telegram_username, task.url):
-            return complete_task(user, task)
-        else:
-            return jsonify({'error': 'Not a member our channel'}), 400
+        # The Bot API looks members up by Telegram user id, which is ours too
+        return start_verification(user, task, user.user_id, 'Not a member our channel')
 
     elif task.type == 'twitter':
-        # Implement Twitter follow verification
         twitter_username = data.get('twitter_username')
         if not twitter_username:
             return jsonify({'error': 'Twitter username not provided'}), 400
 
-        if verify_twitter_follow(twitter_username, task.url):
-            return complete_task(user, task)
-        else:
-            return jsonify({'error': 'Not following the Twitter account'}), 400
+        return start_verification(user, task, twitter_username, 'Not following the Twitter account')
 
     elif task.type == 'achievement':
-        user_balance = user.balance  # Assuming user object has a balance attribute
+        user_balance = current_balance(user, pending)
         if user_balance >= task.required_balance:
             return complete_task(user, task)
         else:
@@ -492,21 +1038,39 @@ def verify_task():
     else:
         return jsonify({'error': 'Invalid task type'}), 400
 
-def verify_telegram_membership(username, channel_url):
-    # This is a placeholder function. In a real-world scenario, you would need to use
-    # Telegram's Bot API to verify channel membership.
-    # For demonstration purposes, we'll assume the verification is successful.
-    app.logger.info(f"Verifying Telegram membership for {username} in {channel_url}")
-    return True
+def start_verification(user, task, identity, failure_message):
+    verifier = current_app.extensions['verifier']
+    if not verifier.handles(task.type):
+        # No provider configured for this task type: accept, as before
+        current_app.logger.info("Skipping %s verification for %s on %s", task.type, identity, task.url)
+        return complete_task(user, task)
+
+    verified = verifier.cached(task.type, identity, task.url)
+    if verified is not None:
+        return complete_task(user, task) if verified else (jsonify({'error': failure_message}), 400)
 
-def verify_twitter_follow(username, twitter_url):
-    # This is a placeholder function. In a real-world scenario, you would need to use
-    # Twitter's API to verify if a user is following an account.
-    # For demonstration purposes, we'll assume the verification is successful.
-    app.logger.info(f"Verifying Twitter follow for {username} on {twitter_url}")
-    return True
+    job_id = verifier.submit(task.type, identity, task.url, {'user_id': user.user_id, 'task_id': task.id})
+    current_app.logger.info("Started %s verification job %s for user_id: %s", task.type, job_id, user.user_id)
+    return jsonify({'status': 'pending', 'job_id': job_id}), 202
+
+@api.route('/api/verify_task/<job_id>', methods=['GET'])
+def get_verification(job_id):
+    job = current_app.extensions['verifier'].status(job_id)
+    if not job:
+        return jsonify({'error': 'Verification job not found'}), 404
+    return jsonify({'job_id': job_id, 'task_id': job['task_id'], 'status': job['status']})
 
 def complete_task(user, task):
+    mark_task_completed(user, task)
+    return jsonify({'success': True, 'message': 'Task completed'})
+
+def mark_task_completed(user, task):
+    event_hub().publish('task', {'task_id': task.id, 'completed': True, 'claimed': False}, user.user_id)
+    write_behind = pending_writes()
+    if write_behind:
+        write_behind.add(user.user_id, tasks={task.id: datetime.utcnow()})
+        return
+
     user_task = UserTask.query.filter_by(user_id=user.id, task_id=task.id).first()
     if not user_task:
         user_task = UserTask(user_id=user.id, task_id=task.id)
@@ -516,14 +1080,41 @@ def complete_task(user, task):
     user_task.completed_at = datetime.utcnow()
     db.session.commit()
 
-    return jsonify({'success': True, 'message': 'Task completed'})
-
-@app.route('/api/claim_task', methods=['POST'])
+@api.route('/api/claim_task', methods=['POST'])
 def claim_task():
     data = request.json
     user_id = data.get('user_id')
     task_id = data.get('task_id')
+    now = datetime.utcnow()
+    settle_pending_writes(user_id)
+
+    task = catalog.task(task_id)
+    row = None
+    if task:
+        owner_id = db.session.query(User.id).filter(User.user_id == user_id).scalar_subquery()
+        claimed = db.session.execute(
+            update(UserTask)
+            .where(
+                UserTask.user_id == owner_id,
+                UserTask.task_id == task.id,
+                UserTask.completed.is_(True),
+                UserTask.claimed.isnot(True),
+                UserTask.completed_at <= now - TASK_CLAIM_COOLDOWN
+            )
+            .values(claimed=True, claimed_at=now)
+            .returning(UserTask.id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if claimed:
+            row = ledger.apply(user_id, task.reward)
+
+    if row:
+        db.session.commit()
+        track_balance(row)
+        event_hub().publish('task', {'task_id': task.id, 'completed': True, 'claimed': True}, row.user_id)
+        return jsonify({'success': True, 'new_balance': row.balance})
 
+    db.session.rollback()
     user = User.query.filter_by(user_id=user_id).first()
     if not user:
         return jsonify({'error': 'User not found'}), 404
@@ -532,43 +1123,93 @@ def claim_task():
     if not user_task or not user_task.completed or user_task.claimed:
         return jsonify({'error': 'Cannot claim task'}), 400
 
-    if datetime.utcnow() - user_task.completed_at < timedelta(minutes=1):
-        return jsonify({'error': 'Task is still on cooldown'}), 400
-
-    task = Task.query.get(task_id)
-    user.balance += task.reward
-    user_task.claimed = True
-    user_task.claimed_at = datetime.utcnow()
-    db.session.commit()
-
-    return jsonify({'success': True, 'new_balance': user.balance})
+    return jsonify({'error': 'Task is still on cooldown'}), 400
 
-@app.route('/api/referrals/<user_id>', methods=['GET'])
+@api.route('/api/referrals/<user_id>', methods=['GET'])
 def get_referrals(user_id):
-    app.logger.info(f"Fetching referrals for user_id: {user_id}")
+    current_app.logger.info("Fetching referrals for user_id: %s", user_id)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    after = request.args.get('after', type=int)
+    window = int(time.time() // REFERRALS_MAX_STALENESS)
+    etag = f"ref-{versions.epoch}-{versions.get(f'referrals:{user_id}')}-{window}-{limit}-{after}"
+    cached = not_modified(etag, 'private, no-cache')
+    if cached:
+        return cached
+
     user = User.query.filter_by(user_id=user_id).first()
     if user:
-        referrals = User.query.join(Referral, Referral.referred_id == User.id).filter(Referral.referrer_id == user.id).all()
+        # Keyset pagination over the referrer_id index: each page starts
+        # after the last Referral.id of the previous one. Referred users are
+        # read separately because they may live on another shard.
+        query = db.session.query(Referral.id, Referral.referred_id).filter(Referral.referrer_id == user.id)
+        if after:
+            query = query.filter(Referral.id > after)
+        referrals = query.order_by(Referral.id).limit(limit + 1).all()
+        next_cursor = referrals[limit - 1].id if len(referrals) > limit else None
+        referrals = referrals[:limit]
+        referred = {
+            row.id: row for row in db.session.query(
+                User.id, User.username, ledger.balance(datetime.utcnow()).label('balance')
+            ).filter(User.id.in_([referral.referred_id for referral in referrals]))
+        } if referrals else {}
+        referrals = [referred[referral.referred_id] for referral in referrals if referral.referred_id in referred]
 
         referral_link = f"https://t.me/yara_miner_bot/mine65?start={user.referral_code}"
 
         referral_data = {
             'referral_code': user.referral_code,
             'referral_link': referral_link,
+            'referral_count': user.referral_count,
             'referrals': [
                 {
                     'username': referral.username,
                     'balance': referral.balance,
                 }
                 for referral in referrals
-            ]
+            ],
+            'next_cursor': next_cursor
         }
-        app.logger.info(f"Referral data for {user.username}: {referral_data}")
-        return jsonify(referral_data)
-    app.logger.warning(f"User not found for referral data request: {user_id}")
+        current_app.logger.info("Returning %s referrals for %s", len(referrals), user.username)
+        log_payload(current_app.logger, "Referral data", referral_data)
+        return cache_headers(jsonify(referral_data), etag, 'private, no-cache')
+    current_app.logger.warning("User not found for referral data request: %s", user_id)
     return jsonify({'error': 'User not found'}), 404
 
+def create_app():
+    app = Flask(__name__)
+    # Render terminates TLS in front of the app; trust that many
+    # X-Forwarded-For hops for the client address
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ.get('YARA_PROXY_COUNT', 1)))
+    CORS(
+        app,
+        resources={r"/*": {"origins": ["http://localhost:3000", "https://yara-miner-bot.vercel.app", "https://t.me"]}},
+        # Lets the frontend read the task list's total alongside a page
+        expose_headers=['X-Total-Count']
+    )
+    configure_storage(app)
+    configure_shards(app)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    init_storage(app, db)
+    init_metrics(app, db)
+    init_profiler(app)
+    init_idempotency(app)
+    init_rate_limits(app)
+    init_read_split(app, db, ReplicaHeartbeat)
+    Migrate(app, db)
+    configure_logging(app)
+    init_events(app)
+    init_write_behind(app)
+    init_verification(app)
+    app.register_blueprint(api)
+    app.register_blueprint(admin)
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     # Get port from environment variable (Render sets this) or default to 5000
     port = int(os.environ.get('PORT', 5000))
     # Run on all interfaces, required for Render
@@ -0,0 +1,131 @@
+"""Worker startup cost: app import, init-db and gunicorn time-to-ready.
+
+Measures, on a temporary database that has already been initialized:
+
+- import_s: a fresh interpreter importing the app (what every worker pays
+  without preload_app)
+- init_db_s: the one-shot schema/seed step on an up-to-date database
+- gunicorn: seconds from launch until the first answer and until every
+  worker has answered once, with preload_app on and off
+
+    python benchmarks/bench_startup.py --workers 9 --runs 5
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def timed_python(code, env):
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def probe(port):
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        connection.request('GET', '/', headers={'Connection': 'close'})
+        connection.getresponse().read()
+        return True
+    except OSError:
+        return False
+
+
+def gunicorn_ready(env, workers, preload, directory):
+    # The access log records the pid of the worker that served each request,
+    # so distinct pids tell how many workers are up. Probes go out in bursts
+    # of concurrent connections to reach every worker.
+    port = free_port()
+    access_log = os.path.join(directory, f"access-{preload}.log")
+    env = dict(env, GUNICORN_PRELOAD='1' if preload else '0', YARA_INIT_DB_ON_START='0')
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers),
+         '-b', f"127.0.0.1:{port}", '--access-logfile', access_log, '--access-logformat', '%(p)s', 'app:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    first_response = None
+    booted = set()
+    try:
+        with ThreadPoolExecutor(workers * 2) as pool:
+            while len(booted) < workers and time.perf_counter() - started < 120:
+                if any(pool.map(probe, [port] * workers * 2)):
+                    if first_response is None:
+                        first_response = time.perf_counter() - started
+                    with open(access_log) as handle:
+                        booted = {line.strip() for line in handle if line.strip()}
+                else:
+                    time.sleep(0.01)
+        all_workers = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {
+        'first_response_s': round(first_response or 0.0, 3),
+        'all_workers_s': round(all_workers, 3),
+        'workers_seen': len(booted),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 2 + 1)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='yara-bench-startup-')
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(directory, 'startup.db')}",
+        YARA_RUNTIME_DIR=os.path.join(directory, 'runtime'),
+        YARA_LOG_LEVEL='WARNING',
+    )
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    init_code = (
+        "import time\nfrom app import app, init_db\n"
+        "with app.app_context():\n    started = time.perf_counter()\n    init_db()\n"
+        "print(time.perf_counter() - started)"
+    )
+    try:
+        first_init = timed_python(init_code, env)
+        import_s = [
+            timed_python("import time\nstarted = time.perf_counter()\nimport app\nprint(time.perf_counter() - started)", env)
+            for _ in range(args.runs)
+        ]
+        init_s = [timed_python(init_code, env) for _ in range(args.runs)]
+        report = {
+            'workers': args.workers,
+            'import_s': round(statistics.median(import_s), 3),
+            'init_db_first_s': round(first_init, 3),
+            'init_db_s': round(statistics.median(init_s), 3),
+            'gunicorn': {
+                'preload': gunicorn_ready(env, args.workers, True, directory),
+                'no_preload': gunicorn_ready(env, args.workers, False, directory),
+            },
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Mixed claim/leaderboard throughput for each storage profile.
+
+Runs several worker processes against one temporary SQLite file, the way
+gunicorn's worker processes share yara_game.db, and prints requests/second
+and latency percentiles for every YARA_DB_PROFILE. Each process issues one
+request at a time; under the default gthread workers every worker thread is
+another such client, so --workers stands for workers x threads.
+
+    python benchmarks/bench_storage.py --workers 8 --duration 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (route, weight)
+MIX = [('claim', 50), ('user', 30), ('leaderboard', 20)]
+
+
+def seed(path, users):
+    os.environ['DATABASE_URL'] = f"sqlite:///{path}"
+    os.environ['YARA_DB_PROFILE'] = 'default'
+    sys.path.insert(0, BACKEND_DIR)
+    from app import app, init_db
+
+    with app.app_context():
+        init_db()
+
+    now = datetime.utcnow().isoformat(sep=' ')
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO user (user_id, username, balance, referral_code, cipher_solved, "
+        "balance_multiplier, mining_multiplier, purchased_multipliers, last_earnings_update) "
+        "VALUES (?, ?, 1000, ?, 0, 1.0, 1.0, '', ?)",
+        [(f"bench{i}", f"bench{i}", f"B{i:07d}", now) for i in range(users)]
+    )
+    connection.commit()
+    connection.close()
+
+
+def worker(profile, path, runtime_dir, users, workers, duration, seed_value, results):
+    os.environ['DATABASE_URL'] = f"sqlite:///{path}"
+    os.environ['YARA_DB_PROFILE'] = profile
+    os.environ.setdefault('LEADERBOARD_REFRESH_SECONDS', '1')
+    # Measure storage, not the rate limiter: with it on, most claims from
+    # one address are 429s. A fresh runtime dir per run keeps shared state
+    # (buckets, caches) from earlier runs out of the numbers.
+    os.environ['YARA_RUNTIME_DIR'] = runtime_dir
+    os.environ['YARA_RATE_LIMIT'] = os.environ.get('YARA_RATE_LIMIT', '0')
+    sys.path.insert(0, BACKEND_DIR)
+    import logging
+    from app import app
+
+    logging.disable(logging.CRITICAL)
+    client = app.test_client()
+    rng = random.Random(seed_value)
+    routes = [route for route, weight in MIX for _ in range(weight)]
+    latencies = {route: [] for route, _ in MIX}
+    errors = 0
+    # Every claim goes to a user who has not claimed yet (each worker takes
+    # its own stride of users), so only a 200 counts as success
+    claimers = iter(range(seed_value, users, workers))
+
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        route = rng.choice(routes)
+        user_id = f"bench{rng.randrange(users)}"
+        started = time.perf_counter()
+        if route == 'claim':
+            claimer = next(claimers, None)
+            if claimer is not None:
+                user_id = f"bench{claimer}"
+            ok = client.post('/api/claim', json={'user_id': user_id}).status_code == 200
+        elif route == 'user':
+            ok = client.get(f'/api/user/{user_id}').status_code == 200
+        else:
+            ok = client.get('/api/leaderboard').status_code == 200
+        latencies[route].append(time.perf_counter() - started)
+        errors += not ok
+
+    results.put((latencies, errors))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_profile(profile, template, workers, users, duration):
+    directory = tempfile.mkdtemp(prefix=f"yara-bench-{profile}-")
+    path = os.path.join(directory, 'bench.db')
+    shutil.copyfile(template, path)
+    runtime_dir = os.path.join(directory, 'runtime')
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(profile, path, runtime_dir, users, workers, duration, n, results))
+        for n in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    report = {'profile': profile, 'errors': sum(errors for _, errors in collected), 'routes': {}}
+    total = 0
+    for route, _ in MIX:
+        samples = [value for latencies, _ in collected for value in latencies[route]]
+        total += len(samples)
+        report['routes'][route] = {
+            'requests': len(samples),
+            'req_per_s': round(len(samples) / duration, 1),
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+        }
+    report['req_per_s'] = round(total / duration, 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 2 + 1)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--profiles', default='default,wal')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='yara-bench-seed-')
+    template = os.path.join(directory, 'seed.db')
+    context = multiprocessing.get_context('spawn')
+    seeder = context.Process(target=seed, args=(template, args.users))
+    seeder.start()
+    seeder.join()
+
+    reports = [
+        run_profile(profile, template, args.workers, args.users, args.duration)
+        for profile in args.profiles.split(',')
+    ]
+    shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(reports, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""Load test modeling Mini App traffic against a local gunicorn.
+
+Seeds a temporary SQLite database with synthetic users, referrals and
+UserTask rows, starts gunicorn on it and replays two phases of traffic:
+
+- steady: app opens (bootstrap), claims from users whose 8h timer just ran
+  out, leaderboard and store views, purchases, profile and task reads
+- cipher_spike: the rush of cipher solves right after the 12:00 reset
+
+Prints per-phase, per-route req/s and p50/p95/p99 latency as JSON (also
+written to --output), tagged with the current commit so runs can be
+compared across commits.
+
+    python benchmarks/loadtest.py --users 20000 --workers 4 --clients 32 --duration 20
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# phase -> [(route, weight)]
+PHASES = {
+    'steady': [
+        ('bootstrap', 20), ('claim', 15), ('leaderboard', 20), ('store_items', 10),
+        ('purchase', 5), ('user', 20), ('tasks', 10),
+    ],
+    'cipher_spike': [('solve_cipher', 60), ('bootstrap', 25), ('leaderboard', 15)],
+}
+
+BALANCE_ITEMS = [5, 6, 7, 8, 9]
+
+
+def seed_schema(path):
+    os.environ['DATABASE_URL'] = f"sqlite:///{path}"
+    sys.path.insert(0, BACKEND_DIR)
+    from app import app, init_db
+
+    with app.app_context():
+        init_db()
+
+
+def seed(path, users, referral_share, claim_share, rng):
+    context = multiprocessing.get_context('spawn')
+    process = context.Process(target=seed_schema, args=(path,))
+    process.start()
+    process.join()
+
+    now = datetime.utcnow()
+    connection = sqlite3.connect(path)
+    task_ids = [row[0] for row in connection.execute("SELECT id FROM task")]
+
+    referrals = []
+    referral_counts = [0] * users
+    for n in range(1, users):
+        if rng.random() < referral_share:
+            referrer = rng.randrange(n)
+            referrals.append((referrer + 1, n + 1, 0))
+            referral_counts[referrer] += 1
+
+    user_rows = []
+    for n in range(users):
+        if rng.random() < claim_share:
+            # Timer ran out just now, so the first claim goes through
+            last_claim = now - timedelta(hours=8, seconds=rng.randrange(1, 600))
+        else:
+            last_claim = now - timedelta(seconds=rng.randrange(1, 8 * 3600 - 600))
+        user_rows.append((
+            n + 1, f"load{n}", f"load{n}", float(rng.randrange(1000, 200000)), last_claim,
+            f"L{n:07d}", now, referral_counts[n]
+        ))
+    connection.executemany(
+        "INSERT INTO user (id, user_id, username, balance, last_claim, cipher_solved, referral_code, "
+        "daily_earnings, last_earnings_update, balance_multiplier, mining_multiplier, purchased_multipliers, "
+        "referral_count) VALUES (?, ?, ?, ?, ?, 0, ?, 0, ?, 1.0, 1.0, '', ?)",
+        [tuple(value.isoformat(sep=' ') if isinstance(value, datetime) else value for value in row)
+         for row in user_rows]
+    )
+    connection.executemany(
+        "INSERT INTO referral (referrer_id, referred_id, claimed) VALUES (?, ?, ?)", referrals
+    )
+
+    user_tasks = []
+    for n in range(users):
+        for task_id in rng.sample(task_ids, rng.randrange(0, min(4, len(task_ids)) + 1)):
+            claimed = rng.random() < 0.5
+            completed_at = (now - timedelta(hours=rng.randrange(1, 72))).isoformat(sep=' ')
+            user_tasks.append((n + 1, task_id, 1, completed_at, int(claimed), completed_at if claimed else None))
+    connection.executemany(
+        "INSERT INTO user_task (user_id, task_id, completed, completed_at, claimed, claimed_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)", user_tasks
+    )
+    connection.commit()
+    connection.close()
+    return {'users': users, 'referrals': len(referrals), 'user_tasks': len(user_tasks)}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(path, runtime_dir, port, workers, log_path):
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{path}",
+        YARA_RUNTIME_DIR=runtime_dir,
+        YARA_LOG_LEVEL=os.environ.get('YARA_LOG_LEVEL', 'WARNING'),
+        # Every simulated user comes from 127.0.0.1
+        YARA_RATE_LIMIT=os.environ.get('YARA_RATE_LIMIT', '0'),
+    )
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    log = open(log_path, 'wb')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-w', str(workers),
+         '-b', f"127.0.0.1:{port}", '--access-logfile', '/dev/null', 'app:app'],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/api/leaderboard')
+            connection.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn did not start, see {log_path}")
+
+
+class Client:
+    # One simulated Mini App session: a keep-alive connection and a user
+    def __init__(self, port, rng):
+        self.port = port
+        self.rng = rng
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            self.connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return 0
+
+    def call(self, route, user_id):
+        if route == 'bootstrap':
+            return self.request('POST', '/api/bootstrap', {'user_id': user_id, 'username': user_id})
+        if route == 'claim':
+            return self.request('POST', '/api/claim', {'user_id': user_id})
+        if route == 'leaderboard':
+            return self.request('GET', '/api/leaderboard')
+        if route == 'store_items':
+            return self.request('GET', f"/api/store/items?user_id={user_id}")
+        if route == 'purchase':
+            return self.request('POST', '/api/purchase', {'user_id': user_id, 'item_id': self.rng.choice(BALANCE_ITEMS)})
+        if route == 'user':
+            return self.request('GET', f"/api/user/{user_id}")
+        if route == 'tasks':
+            return self.request('GET', f"/api/tasks?user_id={user_id}")
+        if route == 'solve_cipher':
+            return self.request('POST', '/api/solve_cipher', {'user_id': user_id, 'solution': 'CARBONITE'})
+        raise ValueError(route)
+
+
+def run_clients(port, users, phase, clients, duration, seed_value, results):
+    routes = [route for route, weight in PHASES[phase] for _ in range(weight)]
+    samples = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def loop(n):
+        rng = random.Random(seed_value * 1000 + n)
+        client = Client(port, rng)
+        local = {}
+        while time.perf_counter() < deadline:
+            route = rng.choice(routes)
+            started = time.perf_counter()
+            status = client.call(route, f"load{rng.randrange(users)}")
+            local.setdefault(route, []).append((time.perf_counter() - started, status))
+        with lock:
+            for route, values in local.items():
+                samples.setdefault(route, []).extend(values)
+
+    threads = [threading.Thread(target=loop, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(samples)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_phase(port, users, phase, processes, clients, duration, seed_value):
+    # Load comes from several processes so the client side's GIL does not
+    # cap the request rate
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    per_process = max(1, clients // processes)
+    workers = [
+        context.Process(target=run_clients, args=(port, users, phase, per_process, duration, seed_value + n, results))
+        for n in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    collected = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    report = {'duration_s': duration, 'clients': per_process * processes, 'routes': {}}
+    total = 0
+    for route, _ in PHASES[phase]:
+        samples = [value for samples in collected for value in samples.get(route, [])]
+        latencies = sorted(elapsed for elapsed, _ in samples)
+        total += len(samples)
+        report['routes'][route] = {
+            'requests': len(samples),
+            'req_per_s': round(len(samples) / duration, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            # 4xx are business answers ("Cannot claim yet"); 5xx and
+            # connection failures are errors
+            'rejected': sum(1 for _, status in samples if 400 <= status < 500),
+            'errors': sum(1 for _, status in samples if status == 0 or status >= 500),
+        }
+    report['req_per_s'] = round(total / duration, 1)
+    return report
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--referral-share', type=float, default=0.3, help='share of users who were referred')
+    parser.add_argument('--claim-share', type=float, default=0.2, help='share of users whose claim timer just ran out')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count() * 2 + 1, help='gunicorn workers')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent simulated clients')
+    parser.add_argument('--client-processes', type=int, default=max(1, multiprocessing.cpu_count() // 2))
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of steady traffic')
+    parser.add_argument('--spike-duration', type=float, default=5.0, help='seconds of cipher reset traffic')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary directory')
+    args = parser.parse_args()
+
+    started_at = datetime.utcnow().isoformat()
+    directory = tempfile.mkdtemp(prefix='yara-loadtest-')
+    path = os.path.join(directory, 'loadtest.db')
+    seeded = seed(path, args.users, args.referral_share, args.claim_share, random.Random(args.seed))
+
+    port = free_port()
+    server = start_gunicorn(
+        path, os.path.join(directory, 'runtime'), port, args.workers, os.path.join(directory, 'gunicorn.log')
+    )
+    try:
+        phases = {
+            'steady': run_phase(port, args.users, 'steady', args.client_processes, args.clients, args.duration, args.seed),
+            'cipher_spike': run_phase(
+                port, args.users, 'cipher_spike', args.client_processes, args.clients, args.spike_duration, args.seed
+            ),
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    report = {
+        'commit': current_commit(),
+        'started_at': started_at,
+        'seed': args.seed,
+        'gunicorn_workers': args.workers,
+        'data': seeded,
+        'phases': phases,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    if args.keep:
+        print(f"Kept {directory}", file=sys.stderr)
+    else:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
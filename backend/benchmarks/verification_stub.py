@@ -0,0 +1,89 @@
+"""Local stand-in for the Telegram Bot API and the Twitter follow check.
+
+Answers getChatMember and follow-check requests after a configurable delay,
+so the verification pipeline can be exercised without real credentials:
+
+    python benchmarks/verification_stub.py --port 8900 --latency 0.5 --deny 42,mallory
+    TELEGRAM_BOT_TOKEN=test TELEGRAM_API_BASE=http://127.0.0.1:8900 \\
+    TWITTER_FOLLOW_CHECK_URL='http://127.0.0.1:8900/twitter/{username}/following/{target}' \\
+        gunicorn app:app
+
+Every user id or username is a member/follower unless listed in --deny.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TELEGRAM_PATH = re.compile(r'^/bot[^/]+/getChatMember$')
+TWITTER_PATH = re.compile(r'^/twitter/([^/]+)/following/([^/]+)$')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    deny = set()
+    counts = {'telegram': 0, 'twitter': 0}
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        telegram = TELEGRAM_PATH.match(url.path)
+        twitter = TWITTER_PATH.match(url.path)
+        if url.path == '/stats':
+            self.reply(200, {**StubHandler.counts, 'max_in_flight': StubHandler.max_in_flight})
+            return
+        if not telegram and not twitter:
+            self.reply(404, {'ok': False, 'description': 'Not Found'})
+            return
+
+        with StubHandler.lock:
+            StubHandler.counts['telegram' if telegram else 'twitter'] += 1
+            StubHandler.in_flight += 1
+            StubHandler.max_in_flight = max(StubHandler.max_in_flight, StubHandler.in_flight)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with StubHandler.lock:
+                StubHandler.in_flight -= 1
+
+        if telegram:
+            user_id = parse_qs(url.query).get('user_id', [''])[0]
+            status = 'left' if user_id in self.deny else 'member'
+            self.reply(200, {'ok': True, 'result': {'status': status, 'user': {'id': user_id}}})
+        else:
+            self.reply(200, {'following': twitter.group(1) not in self.deny})
+
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds before each answer')
+    parser.add_argument('--deny', default='', help='comma-separated user ids/usernames that fail verification')
+    args = parser.parse_args()
+
+    StubHandler.latency = args.latency
+    StubHandler.deny = {name.strip() for name in args.deny.split(',') if name.strip()}
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"Verification stub listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+
+class CatalogCache:
+    # Process-local copy of the StoreItem, Task and CipherPuzzle tables. The tables only
+    # change through admin edits, so every worker keeps detached snapshots
+    # of the rows and re-reads them when the catalog version row moves. The
+    # version is checked at most once per `check_interval` seconds, which
+    # bounds how long another worker's edit takes to show up here.
+
+    def __init__(self, db, version_model, item_model, task_model, puzzle_model, check_interval=5):
+        self.db = db
+        self.version_model = version_model
+        self.item_model = item_model
+        self.task_model = task_model
+        self.puzzle_model = puzzle_model
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+        self._items = {}
+        self._tasks = {}
+        self._puzzles = []
+        self._item_fragments = []
+        event.listen(Session, 'before_flush', self._bump_on_change)
+
+    @property
+    def version(self):
+        self._refresh()
+        return self._version
+
+    def store_items(self):
+        self._refresh()
+        return list(self._items.values())
+
+    def store_item(self, item_id):
+        self._refresh()
+        return self._items.get(_key(item_id))
+
+    def tasks(self):
+        self._refresh()
+        return list(self._tasks.values())
+
+    def task(self, task_id):
+        self._refresh()
+        return self._tasks.get(_key(task_id))
+
+    def puzzles(self):
+        self._refresh()
+        return self._puzzles
+
+    def store_items_with(self, is_purchased):
+        return [{**vars(item), 'purchased': is_purchased(item)} for item in self.store_items()]
+
+    def store_items_json(self, is_purchased):
+        # The item fields are serialized once per catalog version; only the
+        # per-user `purchased` flag is filled in per request.
+        self._refresh()
+        return '[' + ','.join(
+            f'{fragment},"purchased":{"true" if is_purchased(item) else "false"}}}'
+            for item, fragment in self._item_fragments
+        ) + ']'
+
+    def bump(self, session):
+        version = self.version_model
+        updated = session.execute(
+            update(version).where(version.id == 1).values(version=version.version + 1)
+        ).rowcount
+        if not updated:
+            session.add(version(id=1, version=1))
+        self._checked_at = None
+
+    def _bump_on_change(self, session, flush_context, instances):
+        models = (self.item_model, self.task_model, self.puzzle_model)
+        changed = (session.new, session.dirty, session.deleted)
+        if any(isinstance(obj, models) for objects in changed for obj in objects):
+            self.bump(session)
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+            session = self.db.session
+            version = session.execute(
+                select(self.version_model.version).where(self.version_model.id == 1)
+            ).scalar() or 0
+            if version != self._version:
+                items = {item.id: _snapshot(item) for item in session.execute(select(self.item_model)).scalars()}
+                tasks = {task.id: _snapshot(task) for task in session.execute(select(self.task_model)).scalars()}
+                puzzles = [
+                    _snapshot(puzzle)
+                    for puzzle in session.execute(select(self.puzzle_model).order_by(self.puzzle_model.id)).scalars()
+                ]
+                self._items = items
+                self._tasks = tasks
+                self._puzzles = puzzles
+                self._item_fragments = [
+                    (item, json.dumps(vars(item), sort_keys=True, separators=(',', ':'))[:-1])
+                    for item in items.values()
+                ]
+                self._version = version
+            self._checked_at = now
+
+
+def _key(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _snapshot(obj):
+    return SimpleNamespace(**{attr.key: getattr(obj, attr.key) for attr in obj.__mapper__.column_attrs})
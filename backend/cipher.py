@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+
+# The daily cipher resets at 12:00 UTC. Rather than clearing every user's
+# state at that instant, each day is numbered (the puzzle epoch) and a user
+# stores the epoch of the cipher they last solved: the cipher is open to
+# them whenever that differs from the current epoch. The reset costs no
+# writes at all, however many users there are.
+RESET_ORIGIN = datetime(1970, 1, 1, 12)
+
+
+def current_epoch(now):
+    return (now - RESET_ORIGIN).days
+
+
+def next_reset(epoch):
+    return RESET_ORIGIN + timedelta(days=epoch + 1)
+
+
+def puzzle_for(epoch, puzzles):
+    # Puzzles rotate by id, one per day. Add new ones ahead of their day:
+    # adding a puzzle shifts which one the rest of the rotation serves.
+    if not puzzles:
+        return None
+    return puzzles[epoch % len(puzzles)]
+
+
+def cipher_state(user, now):
+    # The cipher fields of a user response
+    epoch = current_epoch(now)
+    solved = user.cipher_epoch == epoch
+    return {
+        'cipher_solved': solved,
+        'next_cipher_time': next_reset(epoch).isoformat() if solved else None
+    }
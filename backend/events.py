@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+from sharedstate import runtime_path
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    def __init__(self, user_id, max_queue):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+
+class LocalBroker:
+    # Stand-in for a Redis-style pub/sub on a single host: every worker binds
+    # a Unix datagram socket in a shared directory and a publish is one
+    # non-blocking sendto per peer. A peer whose receive buffer is full just
+    # misses the message, so a stalled worker never slows down the others.
+
+    def __init__(self, directory, on_message, peer_refresh=1.0):
+        self.directory = directory
+        self.on_message = on_message
+        self.peer_refresh = peer_refresh
+        self._path = None
+        self._sender = None
+        self._peers = []
+        self._peers_at = 0.0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # One socket per hub, so two apps in a process do not share one
+        self._path = os.path.join(self.directory, f"{os.getpid()}-{id(self):x}.sock")
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(self._path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        threading.Thread(target=self._receive, args=(receiver,), name='event-broker', daemon=True).start()
+
+    def publish(self, message):
+        for peer in self._current_peers():
+            try:
+                self._sender.sendto(message, peer)
+            except BlockingIOError:
+                pass
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The worker behind this socket has exited
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+                self._peers_at = 0.0
+
+    def _current_peers(self):
+        now = time.monotonic()
+        if now - self._peers_at >= self.peer_refresh:
+            self._peers = [
+                os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith('.sock') and os.path.join(self.directory, name) != self._path
+            ]
+            self._peers_at = now
+        return self._peers
+
+    def _receive(self, receiver):
+        while True:
+            message = receiver.recv(65536)
+            try:
+                self.on_message(message)
+            except Exception:
+                logger.exception("Failed to handle broker message")
+
+
+class EventHub:
+    # In-process pub/sub feeding the /api/events SSE streams. Events carry a
+    # `user_id` (delivered to that user's streams) or none (delivered to
+    # every stream). Events published in this worker are also forwarded to
+    # the other workers through the broker, and `remote_listeners` get a
+    # look at every event that arrives from another worker.
+
+    def __init__(self, max_queue=100, max_streams=4):
+        self.max_queue = max_queue
+        self.max_streams = max_streams
+        self.remote_listeners = []
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._broker = None
+        self._pid = None
+
+    def ensure_started(self):
+        # The broker's socket and thread are per process, so they are set up
+        # lazily in each forked worker.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._subscribers = {}
+            self._count = 0
+            self._broker = LocalBroker(runtime_path('events'), self._receive)
+            self._broker.start()
+            self._pid = os.getpid()
+
+    def publish(self, event_type, data, user_id=None):
+        self.ensure_started()
+        event = {'type': event_type, 'user_id': user_id, 'data': data}
+        self._deliver(event)
+        self._broker.publish(json.dumps(event, default=str).encode())
+
+    def subscribe(self, user_id):
+        self.ensure_started()
+        with self._lock:
+            if self._count >= self.max_streams:
+                return None
+            subscriber = Subscriber(user_id, self.max_queue)
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+            self._count += 1
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            streams = self._subscribers.get(subscriber.user_id)
+            if streams and subscriber in streams:
+                streams.discard(subscriber)
+                self._count -= 1
+                if not streams:
+                    del self._subscribers[subscriber.user_id]
+
+    def _receive(self, message):
+        event = json.loads(message)
+        for listener in self.remote_listeners:
+            listener(event)
+        self._deliver(event)
+
+    def _deliver(self, event):
+        with self._lock:
+            if event['user_id'] is None:
+                targets = [s for streams in self._subscribers.values() for s in streams]
+            else:
+                targets = list(self._subscribers.get(event['user_id'], ()))
+        for subscriber in targets:
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                # A client that stops reading is disconnected; EventSource
+                # reconnects and the client resyncs with a normal fetch.
+                subscriber.overflowed = True
+
+
+def stream(hub, subscriber, heartbeat=15, max_duration=300):
+    # SSE body for one subscriber: queued events, a comment line every
+    # `heartbeat` seconds to keep proxies from closing the connection, and a
+    # clean end after `max_duration` so connections get rebalanced.
+    deadline = time.monotonic() + max_duration
+    try:
+        yield f"retry: {heartbeat * 1000}\n\n"
+        while not subscriber.overflowed and time.monotonic() < deadline:
+            try:
+                event = subscriber.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+    finally:
+        hub.unsubscribe(subscriber)
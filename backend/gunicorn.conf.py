@@ -1,4 +1,8 @@
 import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
 
 # Bind to 0.0.0.0 to allow external access
 bind = "0.0.0.0:$PORT"
@@ -6,8 +10,17 @@ bind = "0.0.0.0:$PORT"
 # Number of worker processes
 workers = multiprocessing.cpu_count() * 2 + 1
 
-# Worker class to use
-worker_class = 'sync'
+# Worker class to use. /api/events streams are served by the gevent
+# server in gunicorn.events.conf.py; a gthread worker here only takes a
+# few of them (see DEFAULT_EVENTS_MAX_STREAMS in app.py).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Import the app once in the master and fork workers from it, so a worker
+# boot (or recycle) costs a fork instead of a full import. Everything that
+# must not cross a fork (database connections, broker sockets, background
+# threads) is reset or created lazily in the child; see storage.init_storage.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
 
 # Timeout for worker processes
 timeout = 120
@@ -17,4 +30,36 @@ accesslog = '-'
 errorlog = '-'
 
 # Log level
-loglevel = 'info' 
\ No newline at end of file
+loglevel = 'info'
+
+def worker_exit(server, worker):
+    # Commit any writes the write-behind queue is still holding
+    app = sys.modules.get('app')
+    write_behind = app.app.extensions.get('write_behind') if app is not None and hasattr(app, 'app') else None
+    if write_behind is not None:
+        write_behind.stop()
+
+def on_starting(server):
+    # Start every deployment with empty shared metric files
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+    # Create/upgrade the schema and seed the catalog once, in the master,
+    # before any worker starts. YARA_INIT_DB_ON_START=0 leaves it to a
+    # separate `flask --app app init-db` release step.
+    if os.environ.get('YARA_INIT_DB_ON_START', '1') != '1':
+        return
+    if server.cfg.preload_app:
+        from app import init_db
+        with server.app.wsgi().app_context():
+            init_db()
+    else:
+        # Loading the app here would preload it anyway
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], check=True)
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
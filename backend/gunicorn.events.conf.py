@@ -0,0 +1,35 @@
+import os
+
+# Server for the /api/events streams, run next to the API server on the same
+# host and with the same YARA_RUNTIME_DIR:
+#
+#   gunicorn -c gunicorn.events.conf.py app:app
+#
+# Under gevent an open stream is a greenlet rather than one of a gthread
+# worker's few threads, so one worker holds thousands of them. Balance,
+# claim and leaderboard events published by the API workers reach it through
+# the local broker in YARA_RUNTIME_DIR. Build the frontend with
+# REACT_APP_EVENTS_URL pointing here.
+bind = f"0.0.0.0:{os.environ.get('EVENTS_PORT', 8001)}"
+
+workers = int(os.environ.get('EVENTS_WORKERS', 1))
+
+# Read by app.py to size the stream cap for gevent
+worker_class = 'gevent'
+os.environ['GUNICORN_WORKER_CLASS'] = worker_class
+worker_connections = int(os.environ.get('EVENTS_WORKER_CONNECTIONS', 2000))
+
+# gevent patches the standard library in each worker, before the app is
+# imported; a preloaded app would hold unpatched locks and threads
+preload_app = False
+
+timeout = 120
+
+accesslog = '-'
+errorlog = '-'
+loglevel = 'info'
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
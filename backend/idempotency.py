@@ -0,0 +1,82 @@
+import hashlib
+import os
+import struct
+
+from flask import g, jsonify, request
+
+from metrics import IDEMPOTENT_REPLAYS
+from ratelimit import request_user_id
+from sharedstate import SharedSlots
+
+# POST endpoints that honour an Idempotency-Key header
+IDEMPOTENT_ENDPOINTS = {'api.claim_tokens', 'api.purchase', 'api.claim_task', 'api.update_balance'}
+
+# Stored value: status (0 while the first request is still running), a
+# fingerprint of the request body, then the response body
+_HEADER = struct.Struct('H8s')
+_IN_PROGRESS = 0
+
+
+def _fingerprint():
+    return hashlib.blake2b(request.get_data(), digest_size=8).digest()
+
+
+def init_idempotency(app):
+    # YARA_IDEMPOTENCY          - 0 turns idempotency keys off
+    # IDEMPOTENCY_TTL_SECONDS   - how long a response can be replayed
+    # IDEMPOTENCY_LOCK_SECONDS  - how long a first attempt holds its key
+    #                             if it never finishes (e.g. a crashed worker)
+    if os.environ.get('YARA_IDEMPOTENCY', '1') != '1':
+        return
+    ttl = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+    lock_ttl = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', 30))
+    # Fixed-size file shared by all workers; once a bucket is full the
+    # entry closest to expiry makes room
+    responses = SharedSlots('idempotency', buckets=16384, ways=4, value_size=1024)
+
+    # Registered ahead of the rate limiter, so a replay is answered from
+    # shared memory before anything else runs: no user lookup, no SQL.
+    @app.before_request
+    def replay_idempotent_request():
+        if request.method != 'POST' or request.endpoint not in IDEMPOTENT_ENDPOINTS:
+            return None
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return None
+        if len(key) > 255:
+            return jsonify({'error': 'Idempotency-Key is too long'}), 400
+        slot = f"{request.endpoint}:{request_user_id()}:{key}"
+        fingerprint = _fingerprint()
+        if responses.set(slot, _HEADER.pack(_IN_PROGRESS, fingerprint), lock_ttl, only_if_absent=True):
+            g.idempotency_slot = slot
+            return None
+
+        stored = responses.get(slot)
+        if stored is None:
+            # Expired between the two calls; let this attempt run unguarded
+            return None
+        status, stored_fingerprint = _HEADER.unpack_from(stored)
+        if stored_fingerprint != fingerprint:
+            IDEMPOTENT_REPLAYS.labels(request.endpoint, 'mismatch').inc()
+            return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+        if status == _IN_PROGRESS:
+            IDEMPOTENT_REPLAYS.labels(request.endpoint, 'in_progress').inc()
+            return jsonify({'error': 'This request is already being processed'}), 409, {'Retry-After': '1'}
+        IDEMPOTENT_REPLAYS.labels(request.endpoint, 'replayed').inc()
+        response = app.response_class(stored[_HEADER.size:], status=status, mimetype='application/json')
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+
+    @app.after_request
+    def store_idempotent_response(response):
+        slot = g.pop('idempotency_slot', None)
+        if slot is None:
+            return response
+        # Server errors and rate limiting are not final; the client's retry
+        # should run again
+        final = response.status_code < 500 and response.status_code != 429
+        body = response.get_data() if final else None
+        value = _HEADER.pack(response.status_code, _fingerprint()) + body if body is not None else None
+        if value is None or not responses.set(slot, value, ttl):
+            responses.delete(slot)
+        return response
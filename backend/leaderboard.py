@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from itertools import islice
+
+from sortedcontainers import SortedList
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    # Ranked view of user balances kept in memory. Entries are ordered by
+    # (-balance, id) so the top of the list is the richest user and ties are
+    # broken by signup order. Every worker process keeps its own copy and
+    # reloads it from the database once it is older than refresh_interval;
+    # between reloads `update` keeps it current. A reload reports whether
+    # it changed the top `top_depth` ranks, the part clients cache.
+
+    def __init__(self, refresh_interval=30, top_depth=100):
+        self.refresh_interval = refresh_interval
+        self.top_depth = top_depth
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._ranked = SortedList()
+        self._entries = {}
+        self._ids = {}
+        self._loaded_at = None
+
+    def __len__(self):
+        return len(self._ranked)
+
+    def is_stale(self):
+        if self._loaded_at is None:
+            return True
+        return time.monotonic() - self._loaded_at >= self.refresh_interval
+
+    def loaded(self):
+        return self._loaded_at is not None
+
+    def refresh(self, fetch, on_top_change=None, wait=True):
+        # Reloads from fetch() (rows as for `load`) once the index is stale,
+        # calling on_top_change when the reload changed the top ranks. The
+        # first load runs on the calling thread and the others wait for it,
+        # unless `wait` is false; after that one background thread reloads
+        # while callers keep reading the current copy.
+        if not self.is_stale():
+            return
+        if self._loaded_at is None and wait:
+            with self._reload_lock:
+                if self._loaded_at is None:
+                    self._reload(fetch, on_top_change)
+            return
+        if self._reload_lock.acquire(blocking=False):
+            threading.Thread(
+                target=self._reload_in_background, args=(fetch, on_top_change), name='leaderboard-reload', daemon=True
+            ).start()
+
+    def _reload_in_background(self, fetch, on_top_change):
+        try:
+            self._reload(fetch, on_top_change)
+        except Exception:
+            logger.exception("Leaderboard reload failed, keeping the current index")
+        finally:
+            self._reload_lock.release()
+
+    def _reload(self, fetch, on_top_change):
+        if self.load(fetch()) and on_top_change:
+            on_top_change()
+
+    def load(self, rows):
+        # Returns whether the top `top_depth` ranks differ from the index
+        # this replaces (always true for the first load)
+        keys = []
+        entries = {}
+        ids = {}
+        for id, user_id, username, balance in rows:
+            balance = balance if balance is not None else 0.0
+            keys.append((-balance, id))
+            entries[id] = (user_id, username, balance)
+            ids[user_id] = id
+        # One sort of the whole list rather than an insert per row
+        ranked = SortedList(keys)
+        top = self._top(ranked, entries)
+        with self._lock:
+            changed = self._loaded_at is None or top != self._top(self._ranked, self._entries)
+            self._ranked = ranked
+            self._entries = entries
+            self._ids = ids
+            self._loaded_at = time.monotonic()
+        return changed
+
+    def _top(self, ranked, entries):
+        return [(id, *entries[id][1:]) for _, id in ranked.islice(0, self.top_depth)]
+
+    def update(self, id, user_id, username, balance):
+        # Returns the best (smallest) rank the user held before or after the
+        # change, or None when nothing changed or the rank is not known.
+        balance = balance if balance is not None else 0.0
+        with self._lock:
+            if self._loaded_at is None:
+                # Nothing loaded in this worker yet: any rank would be made
+                # up, and the first load reads the new balance anyway
+                return None
+            previous = self._entries.get(id)
+            rank = None
+            if previous is not None:
+                if previous[2] == balance and previous[1] == username:
+                    return None
+                rank = self._ranked.index((-previous[2], id)) + 1
+                self._ranked.remove((-previous[2], id))
+            self._ranked.add((-balance, id))
+            self._entries[id] = (user_id, username, balance)
+            self._ids[user_id] = id
+            new_rank = self._ranked.index((-balance, id)) + 1
+            return new_rank if rank is None else min(rank, new_rank)
+
+    def page(self, offset=0, limit=10):
+        with self._lock:
+            keys = list(islice(self._ranked.islice(offset), limit))
+            return [self._entry(offset + i + 1, id) for i, (_, id) in enumerate(keys)]
+
+    def rank(self, user_id):
+        with self._lock:
+            id = self._ids.get(user_id)
+            if id is None:
+                return None
+            balance = self._entries[id][2]
+            position = self._ranked.index((-balance, id))
+            return self._entry(position + 1, id)
+
+    def _entry(self, rank, id):
+        user_id, username, balance = self._entries[id]
+        return {'rank': rank, 'user_id': user_id, 'username': username, 'balance': balance}
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, Float, bindparam, case, cast, func, update
+
+
+class BalanceLedger:
+    # Applies balance deltas as a single conditional UPDATE ... RETURNING
+    # statement, so the check ("last claim older than 8h", "balance covers
+    # the price") and the write happen atomically inside SQLite instead of
+    # as a SELECT followed by a Python read-modify-write.
+    #
+    # Mining accrues lazily: a user earns `mining_rate * mining_multiplier`
+    # tokens a day since last_earnings_update, which nothing writes until
+    # the balance changes for another reason. Reads add the unsettled part
+    # (`unsettled`, or `balance` in SQL) and every UPDATE here settles it in
+    # the same statement, so mining costs nothing per user between writes.
+
+    def __init__(self, db, model, mining_rate=0):
+        self.db = db
+        self.model = model
+        self.mining_rate = mining_rate
+        # SQLite hands back integral REAL values as ints from RETURNING,
+        # so the float columns are cast to keep the JSON output unchanged.
+        self.columns = (
+            model.id,
+            model.user_id,
+            model.username,
+            cast(model.balance, Float).label('balance'),
+            cast(model.balance_multiplier, Float).label('balance_multiplier'),
+            cast(model.mining_multiplier, Float).label('mining_multiplier'),
+        )
+
+    def daily_rate(self, user):
+        multiplier = user.mining_multiplier if user.mining_multiplier is not None else 1
+        return self.mining_rate * multiplier
+
+    def unsettled(self, user, now):
+        if not self.mining_rate or user.last_earnings_update is None:
+            return 0.0
+        days = (now - user.last_earnings_update).total_seconds() / 86400
+        return max(days, 0) * self.daily_rate(user)
+
+    def balance(self, now):
+        # SQL expression for the balance including unsettled mining
+        model = self.model
+        if not self.mining_rate:
+            return func.coalesce(model.balance, 0)
+        days = func.julianday(bindparam(None, now, type_=DateTime)) - func.julianday(model.last_earnings_update)
+        mined = case(
+            (model.last_earnings_update.is_(None), 0.0),
+            (days <= 0, 0.0),
+            else_=days * self.mining_rate * func.coalesce(model.mining_multiplier, 1)
+        )
+        return func.coalesce(model.balance, 0) + mined
+
+    def apply(self, user_id, delta, *conditions, floor=None, now=None, **values):
+        # Returns the updated row, or None when the user does not exist or
+        # one of the conditions did not hold. The caller owns the commit.
+        # Conditions on the balance should use `balance(now)` with the same
+        # `now`, so they see the earnings this statement settles.
+        model = self.model
+        now = now or datetime.utcnow()
+        balance = self.balance(now) + delta
+        if floor is not None:
+            balance = case((balance < floor, floor), else_=balance)
+        stmt = (
+            update(model)
+            .where(model.user_id == user_id, *conditions)
+            .values(balance=balance, last_earnings_update=now, **values)
+            .returning(*self.columns)
+            .execution_options(synchronize_session=False)
+        )
+        return self.db.session.execute(stmt).first()
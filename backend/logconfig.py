@@ -0,0 +1,152 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import current_app, g, has_request_context, request
+from flask.logging import default_handler
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+# and ends up as a field of the structured record.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestSampler(logging.Filter):
+    # Keeps or drops all of a request's INFO/DEBUG records together, based on
+    # a per-endpoint sampling rate. Warnings and errors are never sampled.
+    # Runs on the logger, i.e. in the request thread, before anything is
+    # formatted or queued, and stamps the request's route on the record.
+
+    def __init__(self, rates, default_rate=1.0):
+        super().__init__()
+        self.rates = rates
+        self.default_rate = default_rate
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        record.route = request.endpoint
+        if record.levelno >= logging.WARNING:
+            return True
+        sampled = g.get('_log_sampled')
+        if sampled is None:
+            rate = self.rates.get(request.endpoint, self.default_rate)
+            sampled = g._log_sampled = rate >= 1 or random.random() < rate
+        return sampled
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Never blocks the worker: records are queued unformatted and dropped
+    # when the queue is full.
+
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def parse_sample_rates(value):
+    # "api.get_leaderboard=0.01,api.get_user=0.1" -> {'api.get_leaderboard': 0.01, 'api.get_user': 0.1}
+    rates = {}
+    for part in filter(None, (part.strip() for part in value.split(','))):
+        endpoint, _, rate = part.partition('=')
+        rates[endpoint.strip()] = float(rate)
+    return rates
+
+
+# Root queue handler, once configure_logging has run in this process
+_queue_handler = None
+
+
+def configure_logging(app):
+    # YARA_LOG_LEVEL         - root level (default INFO)
+    # YARA_LOG_FORMAT        - json or text (default json)
+    # YARA_LOG_SAMPLE_RATES  - per-endpoint INFO sampling, e.g. api.get_leaderboard=0.01
+    # YARA_LOG_SAMPLE_DEFAULT- sampling rate for endpoints not listed (default 1)
+    # YARA_LOG_PAYLOADS      - 0 drops request/response bodies from the log
+    # YARA_LOG_QUEUE_SIZE    - records buffered before new ones are dropped
+    global _queue_handler
+    app.config['YARA_LOG_PAYLOADS'] = os.environ.get('YARA_LOG_PAYLOADS', '1') == '1'
+
+    # Records go through the root queue handler only; Flask adds its own
+    # stderr handler when app.logger is first used before this runs
+    app.logger.removeHandler(default_handler)
+
+    # Apps share their logger by name; a later app replaces the sampler
+    for existing in [f for f in app.logger.filters if isinstance(f, RequestSampler)]:
+        app.logger.removeFilter(existing)
+    app.logger.addFilter(RequestSampler(
+        parse_sample_rates(os.environ.get('YARA_LOG_SAMPLE_RATES', '')),
+        float(os.environ.get('YARA_LOG_SAMPLE_DEFAULT', 1.0))
+    ))
+
+    # The root handler and its listener thread are per process: set up by
+    # the first app only, so a second app does not duplicate every line
+    if _queue_handler is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    if os.environ.get('YARA_LOG_FORMAT', 'json') == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(
+            '%(levelname)s:%(name)s:%(route)s:%(message)s %(payload)s',
+            defaults={'route': None, 'payload': ''}
+        ))
+
+    queue_size = int(os.environ.get('YARA_LOG_QUEUE_SIZE', 10000))
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    root = logging.getLogger()
+    root.setLevel(os.environ.get('YARA_LOG_LEVEL', 'INFO').upper())
+    root.addHandler(handler)
+    _queue_handler = handler
+
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(lambda: listener.stop())
+
+    # The listener thread does not survive a fork and may have held the
+    # queue's lock when it happened, so forked gunicorn workers get a fresh
+    # queue and their own listener.
+    def restart_listener():
+        nonlocal listener
+        handler.queue = queue.Queue(maxsize=queue_size)
+        listener = QueueListener(handler.queue, output, respect_handler_level=True)
+        listener.start()
+
+    os.register_at_fork(after_in_child=restart_listener)
+
+
+def log_payload(logger, message, payload):
+    # Request/response bodies are logged at DEBUG and only when
+    # YARA_LOG_PAYLOADS is on. Pass a callable for a payload that is costly
+    # to build; it is only called when the payload is logged.
+    if current_app.config.get('YARA_LOG_PAYLOADS') and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message, extra={'payload': payload() if callable(payload) else payload})
@@ -0,0 +1,144 @@
+import os
+import time
+
+from flask import Response, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Metrics are shared across gunicorn workers through prometheus_client's
+# multiprocess mode: set PROMETHEUS_MULTIPROC_DIR to an empty directory
+# before the workers start (gunicorn.conf.py clears it on boot).
+
+REQUEST_LATENCY = Histogram(
+    'yara_request_duration_seconds', 'Request latency by route',
+    ['route', 'method', 'status'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+REQUEST_SQL_QUERIES = Histogram(
+    'yara_request_sql_queries', 'SQL statements issued per request',
+    ['route'],
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 32, 64)
+)
+REQUEST_SQL_SECONDS = Histogram(
+    'yara_request_sql_seconds', 'Time spent executing SQL per request',
+    ['route'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+# SQLite takes its write lock on the first write of a transaction and again
+# when committing, and any busy-waiting on other workers happens there. This
+# histogram covers exactly those two steps.
+REQUEST_DB_LOCK_WAIT = Histogram(
+    'yara_request_db_lock_wait_seconds', 'Time spent acquiring the SQLite write lock per request',
+    ['route'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+SQL_QUERIES = Counter('yara_sql_queries', 'SQL statements executed', ['route'])
+RATE_LIMITED = Counter('yara_rate_limited', 'Requests rejected by the rate limiter', ['route', 'scope'])
+IDEMPOTENT_REPLAYS = Counter(
+    'yara_idempotent_replays', 'Requests answered from the idempotency store', ['route', 'outcome']
+)
+DB_READS = Counter('yara_db_reads', 'Read-only requests by the database that served them', ['route', 'target'])
+
+_WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'sql_seconds', 'lock_wait', 'commit_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.lock_wait = 0.0
+        self.commit_started = None
+
+
+def _stats():
+    if has_request_context():
+        return g.get('_request_stats')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _stats()
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - conn.info.pop('query_started', time.perf_counter())
+    stats.queries += 1
+    stats.sql_seconds += elapsed
+    if not conn.info.get('holds_write_lock') and statement.lstrip()[:7].upper().startswith(_WRITE_STATEMENTS):
+        conn.info['holds_write_lock'] = True
+        stats.lock_wait += elapsed
+
+
+def _before_commit(conn):
+    conn.info.pop('holds_write_lock', None)
+    stats = _stats()
+    if stats is not None:
+        stats.commit_started = time.perf_counter()
+
+
+def _after_commit(session):
+    stats = _stats()
+    if stats is not None and stats.commit_started is not None:
+        stats.lock_wait += time.perf_counter() - stats.commit_started
+        stats.commit_started = None
+
+
+def _after_rollback(conn):
+    conn.info.pop('holds_write_lock', None)
+
+
+def instrument_engine(engine):
+    # Per-request SQL counts and times; engines created outside db.engines
+    # (the read-split engines) are passed in by whoever creates them
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'commit', _before_commit)
+    event.listen(engine, 'rollback', _after_rollback)
+
+
+def init_metrics(app, db):
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        instrument_engine(engine)
+    event.listen(Session, 'after_commit', _after_commit)
+
+    @app.before_request
+    def start_request_stats():
+        g._request_stats = RequestStats()
+
+    @app.after_request
+    def record_request_stats(response):
+        stats = g.pop('_request_stats', None)
+        if stats is not None:
+            route = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(time.perf_counter() - stats.started)
+            REQUEST_SQL_QUERIES.labels(route).observe(stats.queries)
+            REQUEST_SQL_SECONDS.labels(route).observe(stats.sql_seconds)
+            REQUEST_DB_LOCK_WAIT.labels(route).observe(stats.lock_wait)
+            SQL_QUERIES.labels(route).inc(stats.queries)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
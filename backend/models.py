@@ -0,0 +1,120 @@
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+
+from readsplit import RoutedSession
+from sharding import ShardedDbSession, shard_count
+
+db = SQLAlchemy(session_options={'class_': ShardedDbSession if shard_count() > 1 else RoutedSession})
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(80), unique=True, nullable=False)
+    username = db.Column(db.String(80), nullable=False)
+    balance = db.Column(db.Float, default=1000)
+    last_claim = db.Column(db.DateTime)
+    # Superseded by cipher_epoch; kept for the data already in them
+    cipher_solved = db.Column(db.Boolean, default=False)
+    next_cipher_time = db.Column(db.DateTime)
+    # Puzzle epoch (see cipher.py) of the user's last solved cipher
+    cipher_epoch = db.Column(db.Integer)
+    last_referral_claim = db.Column(db.DateTime)
+    referral_code = db.Column(db.String(10), unique=True, nullable=False)
+    daily_earnings = db.Column(db.Float, default=0)
+    # Mining is settled into balance up to this time (see ledger.py)
+    last_earnings_update = db.Column(db.DateTime, default=datetime.utcnow)
+    wallet_address = db.Column(db.String(255))
+    last_ton_purchase = db.Column(db.DateTime)
+    balance_multiplier = db.Column(db.Float, default=1.0)
+    mining_multiplier = db.Column(db.Float, default=1.0)
+    # Superseded by UserItem; kept for the data already in it
+    purchased_multipliers = db.Column(db.String(255), default='')
+    referral_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Referrer's User.id while the referral bonus is not yet credited on the
+    # referrer's shard (see credit_referral in app.py)
+    referred_by = db.Column(db.Integer)
+    # Unknown (NULL) for users created before this column existed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class StoreItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.String(255))
+    price = db.Column(db.Float, nullable=False)
+    currency = db.Column(db.String(10), nullable=False)
+    multiplier = db.Column(db.Float, nullable=False)
+
+
+class UserItem(db.Model):
+    # Balance store items a user owns, one row per purchase
+    __table_args__ = (db.UniqueConstraint('user_id', 'item_id', name='uq_user_item_user_id_item_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('store_item.id'), nullable=False, index=True)
+    purchased_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Referral(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    referrer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    referred_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    claimed = db.Column(db.Boolean, default=False)
+
+
+class Task(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    reward = db.Column(db.Float, nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    url = db.Column(db.String(200))
+    required_count = db.Column(db.Integer, default=1)
+    required_balance = db.Column(db.Integer)
+
+
+class CipherPuzzle(db.Model):
+    # Daily cipher answers, served in rotation by id (see cipher.py)
+    id = db.Column(db.Integer, primary_key=True)
+    solution = db.Column(db.String(50), nullable=False)
+    hint = db.Column(db.String(255))
+
+
+class CatalogVersion(db.Model):
+    # Single row, bumped whenever StoreItem, Task or CipherPuzzle rows change so every
+    # worker's catalog cache knows to reload
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserTask(db.Model):
+    __table_args__ = (db.Index('ix_user_task_user_id_task_id', 'user_id', 'task_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    completed = db.Column(db.Boolean, default=False)
+    completed_at = db.Column(db.DateTime)
+    claimed = db.Column(db.Boolean, default=False)
+    claimed_at = db.Column(db.DateTime)
+
+
+class Sequence(db.Model):
+    # Named counters handed out to workers in blocks (see referralcodes.py)
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MiningRate(db.Model):
+    # Single row: the MINING_DAILY_RATE balances were last settled at, so a
+    # deploy that changes the rate can settle the old one first (see
+    # start_mining_clocks in app.py)
+    id = db.Column(db.Integer, primary_key=True)
+    rate = db.Column(db.Float, nullable=False)
+
+
+class ReplicaHeartbeat(db.Model):
+    # Single row stamped on the primary so replica lag can be measured
+    # (see readsplit.py)
+    id = db.Column(db.Integer, primary_key=True)
+    beat = db.Column(db.DateTime)
@@ -0,0 +1,283 @@
+import json
+import os
+import random
+import shutil
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Flask, request
+
+from sharedstate import SharedSlots, runtime_path
+
+# On-demand sampling profiler. A session is started from the admin API (or
+# by sending YARA_PROFILE_SIGNAL to the gunicorn master) and recorded in a
+# shared slot that each worker re-reads at most every POLL_SECONDS, so with
+# no session running a request costs one clock read. During a session a
+# fraction of requests is sampled: a thread per worker reads the stacks of
+# the sampled requests' threads every few milliseconds and counts them,
+# rooted at the request's route. Each worker dumps its counts under
+# <profile dir>/<session>/ every FLUSH_SECONDS and when the session ends:
+#   <pid>.folded         - collapsed stacks ("route;frame;...;leaf count"),
+#                          the input format of flamegraph.pl and speedscope
+#   <pid>.requests.json  - sampled requests per route
+# `load_profile` merges the workers' files.
+POLL_SECONDS = 0.5
+FLUSH_SECONDS = 1.0
+
+_control = SharedSlots('profiler', buckets=1, ways=1, value_size=256)
+
+
+def profile_dir():
+    return os.environ.get('YARA_PROFILE_DIR') or runtime_path('profiles')
+
+
+def session_defaults():
+    # YARA_PROFILE_SECONDS      - how long a session runs unless stopped
+    # YARA_PROFILE_SAMPLE_RATE  - fraction of requests sampled
+    # YARA_PROFILE_INTERVAL_MS  - time between stack samples
+    return {
+        'seconds': float(os.environ.get('YARA_PROFILE_SECONDS', 60)),
+        'rate': float(os.environ.get('YARA_PROFILE_SAMPLE_RATE', 0.1)),
+        'interval_ms': float(os.environ.get('YARA_PROFILE_INTERVAL_MS', 5)),
+    }
+
+
+def current_session():
+    value = _control.get('session')
+    return json.loads(value) if value else None
+
+
+def start_session(seconds, rate, interval_ms):
+    session = {
+        'id': f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{os.getpid()}",
+        'rate': rate,
+        'interval': interval_ms / 1000,
+        'until': time.time() + seconds,
+    }
+    _control.set('session', json.dumps(session).encode(), seconds)
+    _prune_sessions(int(os.environ.get('YARA_PROFILE_KEEP', 10)))
+    return session
+
+
+def stop_session():
+    session = current_session()
+    _control.delete('session')
+    return session
+
+
+def list_sessions():
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+
+def _prune_sessions(keep):
+    # The new session's directory is created by the first worker to flush
+    for name in list_sessions()[:-keep or None]:
+        shutil.rmtree(os.path.join(profile_dir(), name), ignore_errors=True)
+
+
+def load_profile(session_id, route=None):
+    # (stacks, requests) merged over every worker's dump. Workers flush at
+    # least once a second, so a session that just ended may still grow.
+    stacks = Counter()
+    requests = Counter()
+    directory = os.path.join(profile_dir(), session_id)
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith('.folded'):
+            with open(path) as folded:
+                for line in folded:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    stacks[stack] += int(count)
+        elif name.endswith('.requests.json'):
+            with open(path) as counts:
+                requests.update(json.load(counts))
+    if route:
+        stacks = Counter({stack: count for stack, count in stacks.items() if stack.split(';', 1)[0] == route})
+        requests = Counter({route: requests[route]})
+    return stacks, requests
+
+
+def folded_lines(stacks):
+    for stack, count in sorted(stacks.items()):
+        yield f"{stack} {count}\n"
+
+
+def hot_functions(stacks, limit=20):
+    # Functions by samples spent in them (self) and under them (total)
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')[1:]
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    samples = sum(stacks.values()) or 1
+    return [
+        {
+            'function': function,
+            'self': count,
+            'total': total[function],
+            'self_percent': round(100 * count / samples, 1),
+            'total_percent': round(100 * total[function] / samples, 1),
+        }
+        for function, count in own.most_common(limit)
+    ]
+
+
+def _short_path(path):
+    _, marker, tail = path.rpartition('site-packages' + os.sep)
+    if marker:
+        return tail
+    directory, name = os.path.split(path)
+    # logging/__init__.py rather than a bare __init__.py
+    return os.path.join(os.path.basename(directory), name) if name == '__init__.py' else name
+
+
+class StackSampler:
+    # Per-process half of the profiler: tracks which threads are serving a
+    # sampled request and runs the sampling thread while a session lasts.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._session = None
+        self._next_poll = 0.0
+        self._running = False
+        self._pid = None
+        self._stacks = Counter()
+        self._requests = Counter()
+        self._labels = {}
+        # Frames above the Flask app (gunicorn, werkzeug) are left out
+        self._root = Flask.wsgi_app.__code__
+
+    def session(self):
+        now = time.monotonic()
+        if now >= self._next_poll:
+            self._next_poll = now + POLL_SECONDS
+            self._session = current_session()
+        return self._session
+
+    def begin(self, route):
+        session = self.session()
+        if session is None or random.random() >= session['rate']:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the parent's sampling thread is not running here
+                self._pid = os.getpid()
+                self._running = False
+                self._threads.clear()
+            if not self._running:
+                self._running = True
+                self._stacks = Counter()
+                self._requests = Counter()
+                threading.Thread(target=self._run, args=(session,), name='profiler', daemon=True).start()
+            self._requests[route] += 1
+            self._threads[threading.get_ident()] = route
+
+    def end(self):
+        if self._threads:
+            self._threads.pop(threading.get_ident(), None)
+
+    def _run(self, session):
+        next_flush = time.monotonic() + FLUSH_SECONDS
+        try:
+            while True:
+                time.sleep(session['interval'])
+                current = self.session()
+                if current is None or current['id'] != session['id']:
+                    break
+                self._sample()
+                if time.monotonic() >= next_flush:
+                    self._flush(session['id'])
+                    next_flush = time.monotonic() + FLUSH_SECONDS
+        finally:
+            self._flush(session['id'])
+            with self._lock:
+                self._running = False
+                self._threads.clear()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident, route in list(self._threads.items()):
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                if frame.f_code is self._root:
+                    break
+                frame = frame.f_back
+            if stack:
+                stack.append(route)
+                self._stacks[';'.join(reversed(stack))] += 1
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            # co_qualname is new in Python 3.11
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = f"{name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _flush(self, session_id):
+        with self._lock:
+            requests = dict(self._requests)
+        stacks = dict(self._stacks)
+        if not requests:
+            return
+        directory = os.path.join(profile_dir(), session_id)
+        os.makedirs(directory, exist_ok=True)
+        _write(os.path.join(directory, f"{os.getpid()}.folded"), ''.join(folded_lines(stacks)))
+        _write(os.path.join(directory, f"{os.getpid()}.requests.json"), json.dumps(requests))
+
+
+def _write(path, text):
+    # Readers merging the dumps never see a half-written file
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as output:
+        output.write(text)
+    os.replace(temporary, path)
+
+
+def init_profiler(app):
+    # YARA_PROFILE_DIR     - where sessions are dumped (default: under
+    #                        YARA_RUNTIME_DIR)
+    # YARA_PROFILE_KEEP    - how many past sessions to keep
+    # YARA_PROFILE_SIGNAL  - signal that starts a session with the defaults
+    #                        above, or stops the running one; empty disables.
+    #                        Send it to the gunicorn master (inherited by the
+    #                        workers when the app is preloaded) or one worker.
+    sampler = StackSampler()
+
+    @app.before_request
+    def sample_request():
+        sampler.begin(request.endpoint or 'unmatched')
+
+    @app.teardown_request
+    def end_sampled_request(exception):
+        sampler.end()
+
+    def toggle():
+        session = stop_session()
+        if session:
+            app.logger.info("Profiling session %s stopped by signal", session['id'])
+        else:
+            defaults = session_defaults()
+            session = start_session(defaults['seconds'], defaults['rate'], defaults['interval_ms'])
+            app.logger.info("Profiling session %s started by signal for %ss", session['id'], defaults['seconds'])
+
+    signal_name = os.environ.get('YARA_PROFILE_SIGNAL', 'SIGPROF')
+    if signal_name and threading.current_thread() is threading.main_thread():
+        # The shared file is locked outside the handler, which may have
+        # interrupted a thread holding it
+        signal.signal(
+            getattr(signal, signal_name),
+            lambda signum, frame: threading.Thread(target=toggle, name='profiler-toggle', daemon=True).start()
+        )
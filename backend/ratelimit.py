@@ -0,0 +1,131 @@
+import fcntl
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+
+from flask import jsonify, request
+
+from metrics import RATE_LIMITED
+from sharedstate import open_mapped_file, runtime_path
+
+# endpoint -> {scope: (requests, seconds)}. Scopes are 'user' (the user_id
+# in the URL or JSON body) and 'ip'. IP limits are loose because many
+# mobile users share a carrier NAT address.
+DEFAULT_LIMITS = {
+    'api.claim_tokens': {'user': (6, 60), 'ip': (120, 60)},
+    'api.solve_cipher': {'user': (10, 60), 'ip': (200, 60)},
+    'api.check_and_create_user': {'user': (10, 60), 'ip': (60, 60)},
+    'api.bootstrap': {'user': (20, 60), 'ip': (120, 60)},
+}
+
+
+class TokenBuckets:
+    # Token buckets shared by all workers, one 24-byte slot per key in a
+    # memory-mapped file: key hash, tokens left, last refill time. Keys that
+    # hash to the same slot take it over with a full bucket, so a collision
+    # can only let a request through, never reject one wrongly.
+
+    _SLOT = struct.Struct('Qdd')
+
+    def __init__(self, name, slots=65536):
+        self.path = runtime_path(name)
+        self.slots = slots
+        self._fd = None
+        self._map = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, per_second, now=None):
+        # Takes one token; returns 0 if it was available, otherwise the
+        # seconds until one will be.
+        now = time.time() if now is None else now
+        key_hash = zlib.crc32(key.encode()) << 32 | zlib.crc32(key.encode()[::-1])
+        offset = key_hash % self.slots * self._SLOT.size
+        self._open()
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._SLOT.size, offset)
+            try:
+                stored_hash, tokens, updated = self._SLOT.unpack_from(self._map, offset)
+                if stored_hash != key_hash:
+                    tokens = capacity
+                else:
+                    tokens = min(capacity, tokens + (now - updated) * per_second)
+                if tokens >= 1:
+                    self._SLOT.pack_into(self._map, offset, key_hash, tokens - 1, now)
+                    return 0
+                self._SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+                return (1 - tokens) / per_second
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._SLOT.size, offset)
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        self._fd, self._map = open_mapped_file(self.path, self.slots * self._SLOT.size)
+        self._pid = os.getpid()
+
+
+def parse_limits(value):
+    # "api.claim_tokens=user:6/60,api.claim_tokens=ip:120/60,api.bootstrap=ip:off"
+    limits = {}
+    for part in filter(None, (part.strip() for part in value.split(','))):
+        endpoint, _, limit = part.partition('=')
+        scope, _, rate = limit.partition(':')
+        if rate.strip() == 'off':
+            limits.setdefault(endpoint.strip(), {})[scope.strip()] = None
+            continue
+        count, _, seconds = rate.partition('/')
+        limits.setdefault(endpoint.strip(), {})[scope.strip()] = (int(count), float(seconds))
+    return limits
+
+
+def merge_limits(defaults, overrides):
+    merged = {endpoint: dict(scopes) for endpoint, scopes in defaults.items()}
+    for endpoint, scopes in overrides.items():
+        merged.setdefault(endpoint, {}).update(scopes)
+    return {
+        endpoint: {scope: limit for scope, limit in scopes.items() if limit}
+        for endpoint, scopes in merged.items()
+    }
+
+
+def request_user_id():
+    if request.view_args and request.view_args.get('user_id'):
+        return str(request.view_args['user_id'])
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and data.get('user_id') is not None:
+        return str(data['user_id'])
+    return request.args.get('user_id')
+
+
+def init_rate_limits(app):
+    # YARA_RATE_LIMIT    - 0 turns the limiter off
+    # YARA_RATE_LIMITS   - per-endpoint overrides of DEFAULT_LIMITS, see parse_limits
+    if os.environ.get('YARA_RATE_LIMIT', '1') != '1':
+        return
+    limits = merge_limits(DEFAULT_LIMITS, parse_limits(os.environ.get('YARA_RATE_LIMITS', '')))
+    buckets = TokenBuckets('ratelimits')
+
+    # Runs before the handler touches the database; a rejected request costs
+    # one JSON parse and a locked read-modify-write of a shared slot.
+    @app.before_request
+    def enforce_rate_limits():
+        scopes = limits.get(request.endpoint)
+        if not scopes:
+            return None
+        for scope, (count, seconds) in scopes.items():
+            key = request.remote_addr if scope == 'ip' else request_user_id()
+            if key is None:
+                continue
+            retry_after = buckets.take(f"{request.endpoint}:{scope}:{key}", count, count / seconds)
+            if retry_after:
+                RATE_LIMITED.labels(request.endpoint, scope).inc()
+                app.logger.info("Rate limited %s by %s: %s", request.endpoint, scope, key)
+                response = jsonify({'error': 'Too many requests, please slow down'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(math.ceil(retry_after))
+                return response
+        return None
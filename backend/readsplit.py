@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import insert, select, update
+
+from metrics import DB_READS, instrument_engine
+from ratelimit import request_user_id
+from sharedstate import SharedSlots
+from storage import create_read_engine
+
+# GET endpoints that only read; everything else keeps using the writers
+READ_ENDPOINTS = {
+    'api.get_user',
+    'api.get_last_purchase_time',
+    'api.get_store_items',
+    'api.get_cipher',
+    'api.get_leaderboard',
+    'api.get_leaderboard_rank',
+    'api.get_tasks',
+    'api.get_referrals',
+    'admin.export',
+    'admin.item_stats',
+}
+
+# Writer engine -> its read-only engine, filled by init_read_split
+_read_engines = {}
+
+
+def read_engine_for(engine):
+    if has_request_context() and g.get('read_only'):
+        return _read_engines.get(engine, engine)
+    return engine
+
+
+class ReadRouting:
+    # Session mixin: while a request is marked read-only, every bind the
+    # session picks (per model, per shard) is swapped for its read engine.
+
+    def get_bind(self, *args, **kwargs):
+        return read_engine_for(super().get_bind(*args, **kwargs))
+
+
+class RoutedSession(ReadRouting, Session):
+    pass
+
+
+class ReplicaLag:
+    # How far a replica trails the primary, from a heartbeat row: one worker
+    # at a time (whoever takes the shared lease) stamps the primary every
+    # `interval` seconds, and readers compare the replica's copy with the
+    # clock, re-reading it at most twice per interval.
+
+    def __init__(self, model, primary, replica, interval=1):
+        self.model = model
+        self.primary = primary
+        self.replica = replica
+        self.interval = interval
+        self.lease = SharedSlots('heartbeat', buckets=1, ways=1, value_size=8)
+        self._lock = threading.Lock()
+        self._lag = float('inf')
+        self._checked_at = 0.0
+        self._pid = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._beat, name='replica-heartbeat', daemon=True).start()
+
+    def seconds(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.interval / 2:
+            with self._lock:
+                if now - self._checked_at >= self.interval / 2:
+                    self._lag = self._measure()
+                    self._checked_at = now
+        return self._lag
+
+    def _measure(self):
+        try:
+            with self.replica.connect() as connection:
+                beat = connection.execute(select(self.model.beat).where(self.model.id == 1)).scalar()
+        except Exception:
+            return float('inf')
+        if beat is None:
+            return float('inf')
+        # The primary's row is up to one interval old by design
+        return max((datetime.utcnow() - beat).total_seconds() - self.interval, 0.0)
+
+    def _beat(self):
+        table = self.model.__table__
+        while True:
+            if self.lease.set('beat', b'', self.interval, only_if_absent=True):
+                try:
+                    with self.primary.begin() as connection:
+                        now = datetime.utcnow()
+                        if not connection.execute(update(table).where(table.c.id == 1).values(beat=now)).rowcount:
+                            connection.execute(insert(table).values(id=1, beat=now))
+                except Exception:
+                    pass
+            time.sleep(self.interval)
+
+
+def init_read_split(app, db, heartbeat_model):
+    # YARA_READ_SPLIT              - 1 sends READ_ENDPOINTS to read-only engines
+    # YARA_READ_DATABASE_URL       - replica of the main database; without it
+    #                                reads use a read-only pool on the same
+    #                                file, which WAL keeps current
+    # YARA_READ_MAX_STALENESS      - replica lag (seconds) beyond which reads
+    #                                go back to the primary
+    # YARA_READ_STICKY_SECONDS     - how long a user's reads stay on the
+    #                                primary after one of their own writes
+    # YARA_READ_HEARTBEAT_SECONDS  - replica lag probe interval
+    if os.environ.get('YARA_READ_SPLIT', '0') != '1':
+        return
+    with app.app_context():
+        writers = dict(db.engines)
+    replica_url = os.environ.get('YARA_READ_DATABASE_URL')
+    lag = None
+    for key, engine in writers.items():
+        url = replica_url if key is None and replica_url else engine.url
+        _read_engines[engine] = create_read_engine(app, url)
+        instrument_engine(_read_engines[engine])
+    if replica_url:
+        lag = ReplicaLag(
+            heartbeat_model, writers[None], _read_engines[writers[None]],
+            interval=float(os.environ.get('YARA_READ_HEARTBEAT_SECONDS', 1))
+        )
+    max_staleness = float(os.environ.get('YARA_READ_MAX_STALENESS', 2))
+    sticky_seconds = float(os.environ.get('YARA_READ_STICKY_SECONDS', 5))
+    recent_writers = SharedSlots('recent_writers', buckets=16384, value_size=8)
+
+    @app.before_request
+    def choose_read_engine():
+        if lag:
+            lag.ensure_started()
+        if request.method != 'GET' or request.endpoint not in READ_ENDPOINTS:
+            return None
+        user_id = request_user_id()
+        if user_id and recent_writers.get(user_id):
+            # Read-your-writes: the user just changed something
+            DB_READS.labels(request.endpoint, 'primary_sticky').inc()
+            return None
+        if lag and lag.seconds() > max_staleness:
+            DB_READS.labels(request.endpoint, 'primary_stale').inc()
+            return None
+        g.read_only = True
+        DB_READS.labels(request.endpoint, 'replica').inc()
+        return None
+
+    @app.after_request
+    def remember_writer(response):
+        if request.method != 'GET' and response.status_code < 400:
+            user_id = request_user_id()
+            if user_id:
+                recent_writers.set(user_id, b'1', sticky_seconds)
+        return response
@@ -0,0 +1,82 @@
+import string
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from sequences import SequenceBlocks
+
+ALPHABET = string.ascii_uppercase + string.digits
+LEGACY_CODE_LENGTH = 8
+CODE_LENGTH = 9
+_SPACE = len(ALPHABET) ** CODE_LENGTH
+_HALF_BITS = 24
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUND_KEYS = (0x3C6EF3, 0xA54FF5, 0x510E52, 0x9B0568)
+
+
+def _permute(value):
+    # Four-round Feistel network: a bijection on 48-bit integers
+    left, right = value >> _HALF_BITS, value & _HALF_MASK
+    for key in _ROUND_KEYS:
+        left, right = right, left ^ (((right * 0x9E3779B1) ^ key) >> 5 & _HALF_MASK)
+    return left << _HALF_BITS | right
+
+
+def encode(number):
+    # 36^9 < 2^48, so re-applying the permutation until the value fits
+    # ("cycle walking") keeps it a bijection on [0, 36^9): distinct sequence
+    # numbers always give distinct codes, and consecutive ones look unrelated.
+    value = _permute(number)
+    while value >= _SPACE:
+        value = _permute(value)
+    digits = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        digits.append(ALPHABET[digit])
+    return ''.join(reversed(digits))
+
+
+def is_well_formed(code):
+    # Legacy codes are 8 random characters, allocated ones CODE_LENGTH
+    return len(code) in (LEGACY_CODE_LENGTH, CODE_LENGTH) and all(char in ALPHABET for char in code)
+
+
+class ReferralCodes:
+    # Hands out referral codes that cannot collide: each worker reserves a
+    # block of sequence numbers (see SequenceBlocks) and encodes them
+    # locally. New codes are 9 characters long, so they never clash with
+    # the random 8-character codes issued before. Codes never change, so
+    # code -> referrer lookups are kept in a bounded LRU cache.
+
+    def __init__(self, db, sequence_model, block_size=100, cache_size=100000):
+        self.numbers = SequenceBlocks(db, sequence_model, 'referral_code', block_size)
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+
+    def allocate(self):
+        return encode(self.numbers.next())
+
+    def resolve(self, code, load):
+        # `load(code)` returns the User row or None; only hits are cached,
+        # so a code that starts existing later is still found.
+        if not is_well_formed(code):
+            return None
+        with self._lock:
+            referrer = self._cache.get(code)
+            if referrer is not None:
+                self._cache.move_to_end(code)
+                return referrer
+        user = load(code)
+        if user is None:
+            return None
+        return self.remember(user)
+
+    def remember(self, user):
+        referrer = SimpleNamespace(id=user.id, user_id=user.user_id, username=user.username)
+        with self._lock:
+            self._cache[user.referral_code] = referrer
+            self._cache.move_to_end(user.referral_code)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return referrer
@@ -0,0 +1,37 @@
+from sqlalchemy import inspect, text
+
+
+def upgrade_schema(db, engine=None):
+    # db.create_all() only creates missing tables. Columns and indexes added
+    # to models after a table already exists are created here, so existing
+    # databases pick them up on the next start. Returns the (table, column)
+    # pairs that were added so callers can backfill them.
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    added = set()
+
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                ddl = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT '{column.server_default.arg}'"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                connection.execute(text(ddl))
+                added.add((table.name, column.name))
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+    return added
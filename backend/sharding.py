@@ -0,0 +1,169 @@
+import operator
+import os
+import zlib
+
+from flask import current_app
+from sqlalchemy import Column, Table
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.sql import operators, visitors
+
+from readsplit import ReadRouting
+
+# YARA_SHARDS splits the per-user tables over that many databases so they
+# have one writer each. The catalog and sequences stay in the main database.
+# With the default of 1 none of this is used and every table lives in
+# DATABASE_URL. The shard count fixes where every user lives, so it must be
+# chosen before the first user signs up; existing data is not moved.
+MAIN = 'main'
+SHARDED_TABLES = ('user', 'user_task', 'referral', 'user_item')
+
+# Columns that identify the shard in a WHERE clause: the Telegram user_id
+# (hashed) or a User.id (which encodes its shard, see ShardedDbSession).
+# Referrals live with the referrer.
+_USER_ID_COLUMNS = {('user', 'user_id')}
+_ID_COLUMNS = {('user', 'id'), ('user_task', 'user_id'), ('user_item', 'user_id'), ('referral', 'referrer_id')}
+
+
+def shard_count():
+    return int(os.environ.get('YARA_SHARDS', 1))
+
+
+def shard_urls(database_url, count):
+    # YARA_SHARD_URLS lists one URL per shard; otherwise shard files sit next
+    # to the main SQLite file (yara_game.db -> yara_game.shard0.db, ...)
+    urls = os.environ.get('YARA_SHARD_URLS')
+    if urls:
+        urls = [url.strip() for url in urls.split(',') if url.strip()]
+        if len(urls) != count:
+            raise ValueError(f"YARA_SHARD_URLS lists {len(urls)} databases, YARA_SHARDS is {count}")
+        return urls
+    base, dot, extension = database_url.rpartition('.')
+    if not dot or '/' in extension:
+        base, extension = database_url, 'db'
+    return [f"{base}.shard{shard}.{extension}" for shard in range(count)]
+
+
+def configure_shards(app):
+    count = shard_count()
+    app.config['YARA_SHARDS'] = count
+    if count > 1:
+        urls = shard_urls(app.config['SQLALCHEMY_DATABASE_URI'], count)
+        app.config['SQLALCHEMY_BINDS'] = {f"shard{shard}": url for shard, url in enumerate(urls)}
+
+
+def shard_names(count):
+    return [f"shard{shard}" for shard in range(count)]
+
+
+def user_shard(user_id, count):
+    return zlib.crc32(str(user_id).encode()) % count
+
+
+def shard_for_user_id(user_id, count):
+    return f"shard{user_shard(user_id, count)}"
+
+
+def shard_for_id(id, count):
+    return f"shard{int(id) % count}"
+
+
+def shard_engines(db):
+    # (name, engine) for every database holding the per-user tables
+    count = current_app.config.get('YARA_SHARDS', 1)
+    if count == 1:
+        return [(MAIN, db.engine)]
+    return [(name, db.engines[name]) for name in shard_names(count)]
+
+
+def each_shard(db):
+    # bind_arguments that pin a statement to one shard, for callers that
+    # walk the shards themselves (e.g. keyset exports). One None entry when
+    # sharding is off.
+    session = db.session()
+    if not isinstance(session, ShardedDbSession):
+        return [None]
+    return [{'shard_id': name} for name in shard_names(session.shard_count)]
+
+
+def _bound_values(element):
+    value = element.effective_value
+    return value if isinstance(value, (list, tuple)) else [value]
+
+
+def route(statement, count):
+    # Shards a statement needs, from the shard key comparisons in it. None
+    # when it does not touch a per-user table, every shard when no key
+    # narrows it down (a scatter, e.g. the leaderboard load).
+    sharded = False
+    shards = set()
+    for element in visitors.iterate(statement):
+        if isinstance(element, Table):
+            sharded = sharded or element.name in SHARDED_TABLES
+            continue
+        if getattr(element, 'operator', None) not in (operator.eq, operators.in_op):
+            continue
+        left, right = element.left, element.right
+        if not isinstance(left, Column) or right.__visit_name__ != 'bindparam':
+            continue
+        key = (left.table.name, left.name)
+        if key in _USER_ID_COLUMNS:
+            shards.update(shard_for_user_id(value, count) for value in _bound_values(right))
+        elif key in _ID_COLUMNS:
+            shards.update(shard_for_id(value, count) for value in _bound_values(right))
+    if not sharded:
+        return None
+    return sorted(shards) if shards else shard_names(count)
+
+
+class ShardedDbSession(ReadRouting, ShardedSession):
+    # Session class for db when YARA_SHARDS > 1. Statements are routed by
+    # `route`; new rows by their user. User ids are handed out by
+    # `allocate_user_id` as n * shards + shard, so any User.id (and the
+    # UserTask, UserItem and Referral columns holding one) names its shard.
+    # Read-only requests get each shard's read engine (see readsplit.py).
+
+    def __init__(self, db, **kwargs):
+        self.shard_count = current_app.config['YARA_SHARDS']
+        shards = {MAIN: db.engine}
+        shards.update({name: db.engines[name] for name in shard_names(self.shard_count)})
+        super().__init__(
+            shard_chooser=self._choose_shard,
+            identity_chooser=self._choose_identity,
+            execute_chooser=self._choose_execute,
+            shards=shards,
+            **kwargs
+        )
+
+    def _choose_shard(self, mapper, instance, clause=None, **kw):
+        table = mapper.local_table.name if mapper is not None else None
+        if table not in SHARDED_TABLES:
+            return MAIN
+        if instance is not None:
+            if table == 'user':
+                return shard_for_user_id(instance.user_id, self.shard_count)
+            if table == 'referral':
+                return shard_for_id(instance.referrer_id, self.shard_count)
+            return shard_for_id(instance.user_id, self.shard_count)
+        shards = route(clause, self.shard_count) if clause is not None else None
+        if not shards or len(shards) != 1:
+            raise ValueError(f"Cannot choose a single shard for {table}")
+        return shards[0]
+
+    def _choose_identity(self, mapper, primary_key, **kw):
+        if mapper.local_table.name == 'user':
+            return [shard_for_id(primary_key[0], self.shard_count)]
+        if mapper.local_table.name in SHARDED_TABLES:
+            return shard_names(self.shard_count)
+        return [MAIN]
+
+    def _choose_execute(self, orm_context):
+        return route(orm_context.statement, self.shard_count) or [MAIN]
+
+
+def allocate_user_id(blocks, user_id):
+    # Id for a new user with this Telegram user_id, or None to let the
+    # database assign one when sharding is off
+    count = current_app.config.get('YARA_SHARDS', 1)
+    if count == 1:
+        return None
+    return (blocks.next() + 1) * count + user_shard(user_id, count)
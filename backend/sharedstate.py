@@ -0,0 +1,193 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+# State that has to be visible to every gunicorn worker on the host lives in
+# small memory-mapped files under YARA_RUNTIME_DIR. All workers map the same
+# file, so reads are plain memory reads and writes take a byte-range lock on
+# just the slot they touch. Byte-range locks belong to the process, so the
+# threads of one (gthread) worker also take a per-instance thread lock.
+
+
+def runtime_path(name):
+    directory = os.environ.get('YARA_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), 'yara_miner')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def open_mapped_file(path, size, initialize=None):
+    # Opens (creating and sizing on first use) a shared file and maps it.
+    # `initialize` runs once, under an exclusive lock, when the file is new.
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+                mapped = mmap.mmap(fd, size)
+                if initialize:
+                    initialize(mapped)
+            else:
+                mapped = mmap.mmap(fd, size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd, mapped
+
+
+class SharedCounters:
+    # Fixed-size table of 64-bit counters addressed by hashing a key. Two
+    # keys can share a slot; callers use the counters as change versions, so
+    # a collision only causes an extra cache miss, never a stale hit. Slot 0
+    # holds a random epoch written when the file is created, so versions
+    # from before the file was recreated are never mistaken for current ones.
+
+    _SLOT = struct.Struct('Q')
+
+    def __init__(self, name, slots=65536):
+        self.path = runtime_path(name)
+        self.slots = slots
+        self._fd = None
+        self._map = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def epoch(self):
+        return self._read(0)
+
+    def get(self, key):
+        return self._read(self._slot(key))
+
+    def incr(self, key):
+        slot = self._slot(key)
+        offset = slot * self._SLOT.size
+        self._open()
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._SLOT.size, offset)
+            try:
+                value = self._SLOT.unpack_from(self._map, offset)[0] + 1
+                self._SLOT.pack_into(self._map, offset, value)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._SLOT.size, offset)
+        return value
+
+    def _slot(self, key):
+        return 1 + zlib.crc32(key.encode()) % (self.slots - 1)
+
+    def _read(self, slot):
+        self._open()
+        return self._SLOT.unpack_from(self._map, slot * self._SLOT.size)[0]
+
+    def _open(self):
+        # Byte-range locks belong to the process that took them, so each
+        # forked worker opens its own descriptor on the shared file.
+        if self._pid == os.getpid():
+            return
+        self._fd, self._map = open_mapped_file(
+            self.path,
+            self.slots * self._SLOT.size,
+            lambda mapped: self._SLOT.pack_into(mapped, 0, random.getrandbits(32))
+        )
+        self._pid = os.getpid()
+
+
+class SharedSlots:
+    # Bounded key/value store shared by all workers: `buckets` groups of
+    # `ways` fixed-size slots, each holding a 64-bit key hash, an expiry time
+    # and up to `value_size` bytes. A key lives in the bucket its hash picks;
+    # when the bucket is full the slot closest to expiry is overwritten, so
+    # the file never grows and expired entries are reclaimed on write.
+
+    _HEADER = struct.Struct('QdI')
+
+    def __init__(self, name, buckets=4096, ways=4, value_size=512):
+        self.path = runtime_path(name)
+        self.buckets = buckets
+        self.ways = ways
+        self.value_size = value_size
+        self.slot_size = self._HEADER.size + value_size
+        self._fd = None
+        self._map = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        self._open()
+        key_hash = _hash64(key)
+        now = time.time() if now is None else now
+        for offset in self._slots(key_hash):
+            stored_hash, expires, length = self._HEADER.unpack_from(self._map, offset)
+            if stored_hash == key_hash and expires > now:
+                start = offset + self._HEADER.size
+                return bytes(self._map[start:start + length])
+        return None
+
+    def set(self, key, value, ttl, only_if_absent=False):
+        # Returns False when the value is too large, or when `only_if_absent`
+        # is set and a live entry for the key already exists.
+        if len(value) > self.value_size:
+            return False
+        self._open()
+        key_hash = _hash64(key)
+        now = time.time()
+        bucket = self._bucket(key_hash)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.ways * self.slot_size, bucket)
+            try:
+                target = None
+                for offset in self._slots(key_hash):
+                    stored_hash, expires, _ = self._HEADER.unpack_from(self._map, offset)
+                    if stored_hash == key_hash and expires > now:
+                        if only_if_absent:
+                            return False
+                        target = offset
+                        break
+                    if target is None or expires < self._HEADER.unpack_from(self._map, target)[1]:
+                        target = offset
+                self._HEADER.pack_into(self._map, target, key_hash, now + ttl, len(value))
+                start = target + self._HEADER.size
+                self._map[start:start + len(value)] = value
+                return True
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.ways * self.slot_size, bucket)
+
+    def delete(self, key):
+        self._open()
+        key_hash = _hash64(key)
+        bucket = self._bucket(key_hash)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.ways * self.slot_size, bucket)
+            try:
+                for offset in self._slots(key_hash):
+                    if self._HEADER.unpack_from(self._map, offset)[0] == key_hash:
+                        self._HEADER.pack_into(self._map, offset, 0, 0.0, 0)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.ways * self.slot_size, bucket)
+
+    def _bucket(self, key_hash):
+        return (key_hash % self.buckets) * self.ways * self.slot_size
+
+    def _slots(self, key_hash):
+        bucket = self._bucket(key_hash)
+        return range(bucket, bucket + self.ways * self.slot_size, self.slot_size)
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        self._fd, self._map = open_mapped_file(self.path, self.buckets * self.ways * self.slot_size)
+        self._pid = os.getpid()
+
+
+def _hash64(key):
+    # Never 0, which marks an empty slot
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
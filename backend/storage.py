@@ -0,0 +1,94 @@
+import os
+
+from sqlalchemy import create_engine, event
+
+DEFAULT_DATABASE_URI = 'sqlite:///yara_game.db'
+
+# YARA_DB_PROFILE selects how SQLite connections are opened:
+#   default - SQLite's stock settings (rollback journal, synchronous=FULL)
+#   wal     - WAL journal with tuned pragmas for many gunicorn workers
+PROFILES = ('default', 'wal')
+
+
+def _int_env(name, default):
+    return int(os.environ.get(name, default))
+
+
+def worker_threads():
+    # Requests one gunicorn worker serves at once; gunicorn.conf.py reads the
+    # same variable for gthread's `threads`
+    return _int_env('GUNICORN_THREADS', 8)
+
+
+def configure_storage(app):
+    profile = os.environ.get('YARA_DB_PROFILE', 'default')
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown YARA_DB_PROFILE: {profile}")
+
+    app.config['YARA_DB_PROFILE'] = profile
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URI)
+
+    if profile == 'wal':
+        busy_timeout_ms = _int_env('YARA_DB_BUSY_TIMEOUT_MS', 5000)
+        app.config['YARA_DB_PRAGMAS'] = {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': busy_timeout_ms,
+            'mmap_size': _int_env('YARA_DB_MMAP_SIZE', 256 * 1024 * 1024),
+            # Negative cache_size is in KiB rather than pages
+            'cache_size': -_int_env('YARA_DB_CACHE_SIZE_KB', 64 * 1024),
+            'temp_store': 'MEMORY',
+        }
+        # A gthread worker runs up to `threads` requests at once, so the pool
+        # holds one connection per thread and no request waits on checkout.
+        # Open /api/events streams do not count: their session is released
+        # before the response body starts streaming.
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': _int_env('YARA_DB_POOL_SIZE', worker_threads()),
+            'max_overflow': _int_env('YARA_DB_MAX_OVERFLOW', 2),
+            'pool_timeout': busy_timeout_ms / 1000,
+            'connect_args': {'timeout': busy_timeout_ms / 1000, 'check_same_thread': False},
+        }
+
+
+def init_storage(app, db):
+    pragmas = app.config.get('YARA_DB_PRAGMAS')
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    for engine in engines:
+        if pragmas and engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _pragma_listener(pragmas))
+
+    # Connections must never be shared across a fork: a gunicorn worker that
+    # inherits the master's pool would write through the parent's file
+    # handles and corrupt SQLite's locking state.
+    def dispose_after_fork():
+        for engine in engines:
+            engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=dispose_after_fork)
+
+
+def create_read_engine(app, url):
+    # Read-only pool for the read/write split (see readsplit.py): the
+    # writers' settings plus query_only, so a stray write fails at once
+    # instead of queueing for the write lock
+    engine = create_engine(url, **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if engine.dialect.name == 'sqlite':
+        pragmas = dict(app.config.get('YARA_DB_PRAGMAS') or {})
+        # The journal mode is stored in the file by the writers
+        pragmas.pop('journal_mode', None)
+        pragmas['query_only'] = 'ON'
+        event.listen(engine, 'connect', _pragma_listener(pragmas))
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+    return engine
+
+
+def _pragma_listener(pragmas):
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return apply_pragmas
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+
+import pytest
+
+# The backend modules are imported flat, the way gunicorn loads app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import TokenBuckets  # noqa: E402
+from sharedstate import SharedCounters, SharedSlots  # noqa: E402
+
+
+class SlowReads:
+    # Wraps a slot layout so every read of a shared slot yields the GIL for
+    # a moment: threads that are not excluded from each other then overlap
+    # between reading a slot and writing it back
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.size = layout.size
+
+    def unpack_from(self, buffer, offset=0):
+        values = self.layout.unpack_from(buffer, offset)
+        time.sleep(0.001)
+        return values
+
+    def pack_into(self, buffer, offset, *values):
+        self.layout.pack_into(buffer, offset, *values)
+
+
+@pytest.fixture
+def slow_reads(monkeypatch):
+    monkeypatch.setattr(SharedSlots, '_HEADER', SlowReads(SharedSlots._HEADER))
+    monkeypatch.setattr(SharedCounters, '_SLOT', SlowReads(SharedCounters._SLOT))
+    monkeypatch.setattr(TokenBuckets, '_SLOT', SlowReads(TokenBuckets._SLOT))
+
+
+@pytest.fixture
+def make_app(monkeypatch, tmp_path):
+    # Builds the real app on a fresh SQLite file and runtime directory; set
+    # any other environment the test needs before calling it
+    monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'yara.db'}")
+    monkeypatch.setenv('YARA_RUNTIME_DIR', str(tmp_path / 'runtime'))
+    monkeypatch.setenv('YARA_RATE_LIMIT', '0')
+    monkeypatch.setenv('YARA_WRITE_BEHIND', '0')
+
+    def make():
+        # Imported here: the module builds its default app from the environment
+        import app as app_module
+
+        app = app_module.create_app()
+        with app.app_context():
+            app_module.init_db()
+        return app
+    return make
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from flask import Blueprint, Flask, jsonify
+
+from idempotency import init_idempotency
+
+
+def make_app(calls):
+    app = Flask(__name__)
+    init_idempotency(app)
+    api = Blueprint('api', __name__)
+
+    @api.route('/api/update_balance', methods=['POST'])
+    def update_balance():
+        calls.append(threading.get_ident())
+        # Keep the first attempt in flight while the others arrive
+        time.sleep(0.2)
+        return jsonify({'success': True, 'new_balance': 100})
+
+    app.register_blueprint(api)
+    return app
+
+
+def test_concurrent_requests_with_one_key_run_the_handler_once(monkeypatch, tmp_path, slow_reads):
+    monkeypatch.setenv('YARA_RUNTIME_DIR', str(tmp_path))
+    calls = []
+    app = make_app(calls)
+    threads = 8
+    barrier = threading.Barrier(threads)
+    statuses = []
+
+    def send():
+        client = app.test_client()
+        barrier.wait()
+        response = client.post(
+            '/api/update_balance', json={'user_id': '1', 'amount': 100}, headers={'Idempotency-Key': 'k1'}
+        )
+        statuses.append(response.status_code)
+
+    workers = [threading.Thread(target=send) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(calls) == 1
+    assert sorted(statuses) == [200] + [409] * (threads - 1)
+
+
+def test_replay_returns_the_stored_response(monkeypatch, tmp_path):
+    monkeypatch.setenv('YARA_RUNTIME_DIR', str(tmp_path))
+    calls = []
+    client = make_app(calls).test_client()
+    body = {'user_id': '1', 'amount': 100}
+    first = client.post('/api/update_balance', json=body, headers={'Idempotency-Key': 'k1'})
+    again = client.post('/api/update_balance', json=body, headers={'Idempotency-Key': 'k1'})
+    other = client.post('/api/update_balance', json={'user_id': '1', 'amount': 5}, headers={'Idempotency-Key': 'k1'})
+
+    assert len(calls) == 1
+    assert again.status_code == 200 and again.get_json() == first.get_json()
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert other.status_code == 422
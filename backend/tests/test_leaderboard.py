@@ -0,0 +1,75 @@
+import threading
+import time
+
+from leaderboard import Leaderboard
+
+ROWS = [(1, 'a', 'alice', 50.0), (2, 'b', 'bob', 80.0), (3, 'c', 'carol', None)]
+
+
+def run_together(target, threads=8):
+    barrier = threading.Barrier(threads)
+
+    def call():
+        barrier.wait()
+        target()
+
+    workers = [threading.Thread(target=call) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def test_load_ranks_by_balance():
+    leaderboard = Leaderboard()
+    leaderboard.load(ROWS)
+    assert [entry['username'] for entry in leaderboard.page(0, 10)] == ['bob', 'alice', 'carol']
+    assert leaderboard.rank('c') == {'rank': 3, 'user_id': 'c', 'username': 'carol', 'balance': 0.0}
+
+
+def test_first_load_runs_once_and_callers_wait_for_it():
+    leaderboard = Leaderboard()
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        time.sleep(0.1)
+        return ROWS
+
+    run_together(lambda: leaderboard.refresh(fetch))
+    assert len(fetches) == 1
+    assert len(leaderboard) == 3
+
+
+def test_stale_index_reloads_once_in_the_background():
+    leaderboard = Leaderboard(refresh_interval=0)
+    leaderboard.load(ROWS)
+    fetches = []
+    reloaded = threading.Event()
+
+    def fetch():
+        fetches.append(1)
+        time.sleep(0.2)
+        return ROWS + [(4, 'd', 'dave', 100.0)]
+
+    started = time.monotonic()
+    run_together(lambda: leaderboard.refresh(fetch, reloaded.set))
+    # Callers kept the old index instead of waiting for the reload
+    assert time.monotonic() - started < 0.2
+    assert len(leaderboard) == 3
+
+    assert reloaded.wait(2)
+    assert len(fetches) == 1
+    assert leaderboard.page(0, 1)[0]['username'] == 'dave'
+
+
+def test_reload_reports_changes_to_the_top_ranks_only():
+    leaderboard = Leaderboard(top_depth=2)
+    assert leaderboard.load(ROWS)
+    assert not leaderboard.load(list(ROWS))
+    # carol is third, below the ranks clients cache
+    assert not leaderboard.load(ROWS[:2] + [(3, 'c', 'carol', 10.0)])
+    assert leaderboard.load(ROWS[:2] + [(3, 'c', 'carol', 60.0)])
+    # A change already applied through update() is not reported again
+    leaderboard.update(1, 'a', 'alice', 90.0)
+    assert not leaderboard.load([(1, 'a', 'alice', 90.0)] + ROWS[1:2] + [(3, 'c', 'carol', 60.0)])
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def app_module():
+    import app as app_module
+    return app_module
+
+
+def age_clock(app, app_module, days):
+    with app.app_context():
+        user = app_module.User.query.filter_by(user_id='1').first()
+        user.last_earnings_update = datetime.utcnow() - timedelta(days=days)
+        app_module.db.session.commit()
+
+
+def test_miner_items_are_refused_while_mining_is_off(make_app, app_module, monkeypatch):
+    monkeypatch.setattr(app_module.ledger, 'mining_rate', 0)
+    client = make_app().test_client()
+    client.post('/api/user/check_and_create', json={'user_id': '1', 'username': 'alice'})
+    response = client.post('/api/purchase', json={'user_id': '1', 'item_id': 5})
+    assert response.status_code == 400
+    assert response.json['error'] == 'Mining is not available'
+
+
+def test_turning_mining_on_does_not_pay_for_the_time_it_was_off(make_app, app_module, monkeypatch):
+    app = make_app()
+    client = app.test_client()
+    client.post('/api/user/check_and_create', json={'user_id': '1', 'username': 'alice'})
+    age_clock(app, app_module, 10)
+
+    # A deploy with mining on
+    monkeypatch.setattr(app_module, 'MINING_DAILY_RATE', 1000.0)
+    monkeypatch.setattr(app_module.ledger, 'mining_rate', 1000.0)
+    with app.app_context():
+        app_module.init_db()
+    assert client.get('/api/user/1').json['balance'] == pytest.approx(1000, abs=1)
+
+    # Later deploys at the same rate keep the mining since then
+    age_clock(app, app_module, 1)
+    with app.app_context():
+        app_module.init_db()
+    assert client.get('/api/user/1').json['balance'] == pytest.approx(2000, abs=1)
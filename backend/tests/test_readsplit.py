@@ -0,0 +1,23 @@
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+
+import metrics
+import readsplit
+
+
+def test_read_engines_report_sql_metrics(monkeypatch, tmp_path):
+    monkeypatch.setenv('YARA_READ_SPLIT', '1')
+    monkeypatch.setenv('YARA_RUNTIME_DIR', str(tmp_path / 'runtime'))
+    monkeypatch.setattr(readsplit, '_read_engines', {})
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'yara.db'}"
+    db = SQLAlchemy()
+    db.init_app(app)
+    readsplit.init_read_split(app, db, None)
+
+    assert readsplit._read_engines
+    for engine in readsplit._read_engines.values():
+        assert event.contains(engine, 'before_cursor_execute', metrics._before_cursor_execute)
+        assert event.contains(engine, 'after_cursor_execute', metrics._after_cursor_execute)
+        assert event.contains(engine, 'commit', metrics._before_commit)
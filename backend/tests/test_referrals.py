@@ -0,0 +1,35 @@
+def create(client, user_id, referral_code=None):
+    response = client.post(
+        '/api/user/check_and_create',
+        json={'user_id': user_id, 'username': f"user{user_id}", 'referral_code': referral_code}
+    )
+    assert response.status_code == 200
+    return response.json
+
+
+def referrer_state(client):
+    referrals = client.get('/api/referrals/1').json
+    return client.get('/api/user/1').json['balance'], referrals['referral_count'], len(referrals['referrals'])
+
+
+def test_failed_referral_credit_is_redone_once(make_app, monkeypatch):
+    client = make_app().test_client()
+    import app as app_module
+
+    code = create(client, '1')['referral_link'].rsplit('=', 1)[1]
+
+    # The referrer's shard fails after the new user is committed
+    apply = app_module.ledger.apply
+
+    def busy(*args, **kwargs):
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(app_module.ledger, 'apply', busy)
+    create(client, '2', code)
+    assert referrer_state(client) == (1000.0, 0, 0)
+
+    monkeypatch.setattr(app_module.ledger, 'apply', apply)
+    for _ in range(3):
+        create(client, '2')
+        client.post('/api/bootstrap?fields=user', json={'user_id': '2', 'username': 'user2'})
+    assert referrer_state(client) == (1000.0 + app_module.REFERRAL_BONUS, 1, 1)
@@ -0,0 +1,51 @@
+import threading
+
+from ratelimit import TokenBuckets
+from sharedstate import SharedCounters, SharedSlots
+
+
+def run_threads(count, target):
+    barrier = threading.Barrier(count)
+
+    def run():
+        barrier.wait()
+        target()
+
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_only_if_absent_admits_one_thread(monkeypatch, tmp_path, slow_reads):
+    monkeypatch.setenv('YARA_RUNTIME_DIR', str(tmp_path))
+    slots = SharedSlots('test_slots', buckets=1, ways=4)
+    taken = []
+    run_threads(16, lambda: taken.append(slots.set('key', b'x', 60, only_if_absent=True)))
+    assert taken.count(True) == 1
+
+
+def test_counter_increments_are_not_lost(monkeypatch, tmp_path, slow_reads):
+    monkeypatch.setenv('YARA_RUNTIME_DIR', str(tmp_path))
+    counters = SharedCounters('test_counters', slots=16)
+
+    def bump():
+        for _ in range(50):
+            counters.incr('key')
+
+    run_threads(8, bump)
+    assert counters.get('key') == 8 * 50
+
+
+def test_token_bucket_does_not_over_admit(monkeypatch, tmp_path, slow_reads):
+    monkeypatch.setenv('YARA_RUNTIME_DIR', str(tmp_path))
+    buckets = TokenBuckets('test_buckets', slots=16)
+    admitted = []
+
+    def take():
+        for _ in range(20):
+            admitted.append(buckets.take('key', capacity=50, per_second=1e-9, now=1000.0) == 0)
+
+    run_threads(8, take)
+    assert admitted.count(True) == 50
@@ -0,0 +1,89 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.verification_stub import StubHandler
+from models import Task, User, UserTask
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # The Telegram and Twitter stand-in from the benchmarks, on a free port
+    monkeypatch.setattr(StubHandler, 'latency', 0.2)
+    monkeypatch.setattr(StubHandler, 'deny', {'mallory'})
+    monkeypatch.setattr(StubHandler, 'counts', {'telegram': 0, 'twitter': 0})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(monkeypatch, make_app, stub):
+    monkeypatch.setenv('TELEGRAM_BOT_TOKEN', 'test')
+    monkeypatch.setenv('TELEGRAM_API_BASE', stub)
+    monkeypatch.setenv('TWITTER_FOLLOW_CHECK_URL', stub + '/twitter/{username}/following/{target}')
+    client = make_app().test_client()
+    response = client.post('/api/user/check_and_create', json={'user_id': '42', 'username': 'alice'})
+    assert response.status_code == 200
+    return client
+
+
+def task_id(client, task_type):
+    with client.application.app_context():
+        return Task.query.filter_by(type=task_type).first().id
+
+
+def completed(client, task):
+    with client.application.app_context():
+        user = User.query.filter_by(user_id='42').first()
+        user_task = UserTask.query.filter_by(user_id=user.id, task_id=task).first()
+        return bool(user_task and user_task.completed)
+
+
+def wait_for(client, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/verify_task/{job_id}").json
+        if job['status'] != 'pending':
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"verification job {job_id} still pending")
+
+
+def test_verified_membership_completes_the_task(client):
+    task = task_id(client, 'telegram')
+    response = client.post('/api/verify_task', json={'user_id': '42', 'task_id': task, 'telegram_username': 'alice'})
+    assert response.status_code == 202
+    job_id = response.json['job_id']
+    assert client.get(f"/api/verify_task/{job_id}").json['status'] == 'pending'
+
+    assert wait_for(client, job_id) == {'job_id': job_id, 'task_id': task, 'status': 'verified'}
+    assert completed(client, task)
+
+    # The cached result answers a retry without asking the provider again
+    response = client.post('/api/verify_task', json={'user_id': '42', 'task_id': task, 'telegram_username': 'alice'})
+    assert response.status_code == 200
+    assert response.json['success']
+    assert StubHandler.counts['telegram'] == 1
+
+
+def test_denied_follow_leaves_the_task_open(client):
+    task = task_id(client, 'twitter')
+    response = client.post('/api/verify_task', json={'user_id': '42', 'task_id': task, 'twitter_username': 'mallory'})
+    assert response.status_code == 202
+
+    assert wait_for(client, response.json['job_id'])['status'] == 'failed'
+    assert not completed(client, task)
+
+    response = client.post('/api/verify_task', json={'user_id': '42', 'task_id': task, 'twitter_username': 'mallory'})
+    assert response.status_code == 400
+    assert response.json['error'] == 'Not following the Twitter account'
+    assert StubHandler.counts['twitter'] == 1
+
+
+def test_unknown_job_is_not_found(client):
+    assert client.get('/api/verify_task/missing').status_code == 404
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from sharedstate import SharedSlots
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+VERIFIED = 'verified'
+FAILED = 'failed'
+ERROR = 'error'
+
+
+class Provider:
+    # One external service. Each provider gets its own thread pool sized to
+    # `concurrency` and its own pooled HTTP session, so a slow provider can
+    # only tie up its own threads and connections.
+
+    def __init__(self, name, check, concurrency=4, timeout=10):
+        self.name = name
+        self.check = check
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._executor = None
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        # Threads and sockets do not survive a fork, so each worker builds
+        # its own pool on first use.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix=f"verify-{self.name}")
+                    self._session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+                    self._session.mount('http://', adapter)
+                    self._session.mount('https://', adapter)
+                    self._pid = os.getpid()
+        self._executor.submit(fn, *args)
+
+    def run(self, identity, target):
+        return self.check(self._session, identity, target, self.timeout)
+
+
+def telegram_provider(token, base_url='https://api.telegram.org', **options):
+    # Bot API getChatMember; the bot has to be an admin of the channel.
+    def check(session, user_id, channel_url, timeout):
+        response = session.get(
+            f"{base_url}/bot{token}/getChatMember",
+            params={'chat_id': '@' + _last_path_segment(channel_url), 'user_id': user_id},
+            timeout=timeout
+        )
+        if response.status_code == 400:
+            # "user not found" and friends
+            return False
+        response.raise_for_status()
+        return response.json()['result']['status'] in ('creator', 'administrator', 'member', 'restricted')
+    return Provider('telegram', check, **options)
+
+
+def twitter_provider(url_template, bearer_token=None, **options):
+    # The Twitter API has no single-call follow check, so this calls a
+    # follow-check service at `url_template` ({username} and {target} are
+    # filled in) that answers {"following": true|false}.
+    headers = {'Authorization': f"Bearer {bearer_token}"} if bearer_token else {}
+
+    def check(session, username, twitter_url, timeout):
+        response = session.get(
+            url_template.format(username=username.lstrip('@'), target=_last_path_segment(twitter_url)),
+            headers=headers,
+            timeout=timeout
+        )
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return bool(response.json().get('following'))
+    return Provider('twitter', check, **options)
+
+
+class VerificationPipeline:
+    # Runs provider checks off the request thread. Job state and results live
+    # in a SharedSlots file, so any worker can answer a poll for a job
+    # started by another one, and a (provider, identity, target) result is
+    # reused by every worker until it expires. Failures are cached for a
+    # shorter time than successes so a user who has just joined can retry.
+
+    def __init__(self, providers, on_result, cache_ttl=600, failure_ttl=30, job_ttl=600):
+        self.providers = providers
+        self.on_result = on_result
+        self.cache_ttl = cache_ttl
+        self.failure_ttl = failure_ttl
+        self.job_ttl = job_ttl
+        self.store = SharedSlots('verification', buckets=1024, value_size=256)
+
+    def handles(self, provider_name):
+        return provider_name in self.providers
+
+    def cached(self, provider_name, identity, target):
+        # True/False for a cached result, None when a check is needed
+        value = self.store.get(_result_key(provider_name, identity, target))
+        return None if value is None else value == b'1'
+
+    def submit(self, provider_name, identity, target, context):
+        # Starts a check and returns its job id. A check already running for
+        # the same key and context is joined instead of started again.
+        provider = self.providers[provider_name]
+        job_id = uuid.uuid4().hex
+        running_key = 'running:' + _result_key(provider_name, identity, target) + json.dumps(context, sort_keys=True)
+        if not self.store.set(running_key, job_id.encode(), provider.timeout * 2, only_if_absent=True):
+            running = self.store.get(running_key)
+            if running is not None and self.status(running.decode()) is not None:
+                return running.decode()
+            self.store.set(running_key, job_id.encode(), provider.timeout * 2)
+        self._save(job_id, PENDING, context)
+        provider.submit(self._run, job_id, provider, identity, target, context, running_key)
+        return job_id
+
+    def status(self, job_id):
+        value = self.store.get('job:' + job_id)
+        return json.loads(value) if value is not None else None
+
+    def _run(self, job_id, provider, identity, target, context, running_key):
+        try:
+            verified = provider.run(identity, target)
+        except Exception:
+            logger.exception("%s verification failed for %s", provider.name, identity)
+            status = ERROR
+        else:
+            self.store.set(
+                _result_key(provider.name, identity, target),
+                b'1' if verified else b'0',
+                self.cache_ttl if verified else self.failure_ttl
+            )
+            status = VERIFIED if verified else FAILED
+        try:
+            self.on_result(job_id, status, context)
+        except Exception:
+            logger.exception("Failed to record verification result for job %s", job_id)
+            status = ERROR
+        self._save(job_id, status, context)
+        self.store.delete(running_key)
+
+    def _save(self, job_id, status, context):
+        self.store.set('job:' + job_id, json.dumps({**context, 'status': status}).encode(), self.job_ttl)
+
+
+def _result_key(provider_name, identity, target):
+    return f"result:{provider_name}:{identity}:{target}"
+
+
+def _last_path_segment(url):
+    return urlparse(url).path.rstrip('/').rsplit('/', 1)[-1]
@@ -1,89 +1,202 @@
-import requests
+import argparse
 import json
+import os
+import sys
+
+import requests
 from tabulate import tabulate
 
-BASE_URL = "https://yara-mine.onrender.com"  # Adjust this if your Flask app is running on a different host/port
+# Adjust YARA_API_URL if your Flask app is running on a different host/port
+BASE_URL = os.environ.get('YARA_API_URL', "https://yara-mine.onrender.com")
 
-def get_all_users():
-    response = requests.get(f"{BASE_URL}/api/leaderboard")
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error: Unable to fetch users. Status code: {response.status_code}")
-        return None
 
-def get_user_details(user_id):
-    response = requests.get(f"{BASE_URL}/api/user/{user_id}")
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error: Unable to fetch user details. Status code: {response.status_code}")
-        return None
+def fail(response):
+    try:
+        message = response.json().get('error')
+    except ValueError:
+        message = response.text
+    sys.exit(f"Error: {response.status_code} {message}")
 
-def get_user_referrals(user_id):
-    response = requests.get(f"{BASE_URL}/api/referrals/{user_id}")
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Error: Unable to fetch user referrals. Status code: {response.status_code}")
-        return None
-
-def display_users():
-    users = get_all_users()
-    if users:
-        headers = ["Username", "Balance"]
-        table_data = [[user['username'], user['balance']] for user in users]
-        print(tabulate(table_data, headers=headers, tablefmt="grid"))
-    else:
-        print("No users found.")
 
-def display_user_details(user_id):
-    user = get_user_details(user_id)
-    if user:
-        print(json.dumps(user, indent=2))
-    else:
-        print(f"User with ID {user_id} not found.")
-
-def display_user_referrals(user_id):
-    referrals = get_user_referrals(user_id)
-    if referrals:
-        print(f"Referral Code: {referrals['referral_code']}")
-        print(f"Referral Link: {referrals['referral_link']}")
-        print(f"Last Claim Time: {referrals['last_claim_time']}")
-        print(f"Claimable Amount: {referrals['claimable_amount']}")
-
-        if referrals['referrals']:
-            headers = ["Username", "Balance", "Earnings"]
-            table_data = [[r['username'], r['balance'], r['earnings']] for r in referrals['referrals']]
-            print("\nReferrals:")
-            print(tabulate(table_data, headers=headers, tablefmt="grid"))
-        else:
-            print("No referrals found.")
-    else:
-        print(f"Unable to fetch referrals for user with ID {user_id}.")
+def show_top(args):
+    response = requests.get(f"{BASE_URL}/api/leaderboard", params={'offset': args.offset, 'limit': args.limit})
+    if response.status_code != 200:
+        fail(response)
+    table_data = [[args.offset + rank, user['username'], user['balance']] for rank, user in enumerate(response.json(), 1)]
+    print(tabulate(table_data, headers=["Rank", "Username", "Balance"], tablefmt="grid"))
 
-def main():
+
+def show_user(args):
+    response = requests.get(f"{BASE_URL}/api/user/{args.user_id}")
+    if response.status_code != 200:
+        fail(response)
+    print(json.dumps(response.json(), indent=2))
+
+
+def show_referrals(args):
+    # Follows next_cursor, printing each page as it arrives
+    params = {'limit': 200}
+    page = 0
     while True:
-        print("\n1. View all users")
-        print("2. View user details")
-        print("3. View user referrals")
-        print("4. Exit")
-
-        choice = input("Enter your choice (1-4): ")
-
-        if choice == '1':
-            display_users()
-        elif choice == '2':
-            user_id = input("Enter user ID: ")
-            display_user_details(user_id)
-        elif choice == '3':
-            user_id = input("Enter user ID: ")
-            display_user_referrals(user_id)
-        elif choice == '4':
-            print("Exiting...")
+        response = requests.get(f"{BASE_URL}/api/referrals/{args.user_id}", params=params)
+        if response.status_code != 200:
+            fail(response)
+        data = response.json()
+        if page == 0:
+            print(f"Referral Code: {data['referral_code']}")
+            print(f"Referral Link: {data['referral_link']}")
+            print(f"Referral Count: {data['referral_count']}")
+            if not data['referrals']:
+                print("No referrals found.")
+        if data['referrals']:
+            table_data = [[r['username'], r['balance']] for r in data['referrals']]
+            print(tabulate(table_data, headers=["Username", "Balance"], tablefmt="grid"))
+        if not data.get('next_cursor'):
             break
-        else:
-            print("Invalid choice. Please try again.")
+        params['after'] = data['next_cursor']
+        page += 1
+
+
+def export(args):
+    # Streams /api/admin/export straight to the output, one chunk at a time,
+    # so exports of any size run in constant memory here too.
+    token = args.token or os.environ.get('ADMIN_TOKEN')
+    if not token:
+        sys.exit("Error: set ADMIN_TOKEN or pass --token")
+    params = {
+        'format': args.format,
+        'min_balance': args.min_balance,
+        'max_balance': args.max_balance,
+        'has_wallet': args.has_wallet,
+        'joined_since': args.joined_since,
+    }
+    with requests.get(
+        f"{BASE_URL}/api/admin/export/{args.kind}",
+        params={name: value for name, value in params.items() if value is not None},
+        headers={'Authorization': f"Bearer {token}"},
+        stream=True,
+        timeout=(10, 300)
+    ) as response:
+        if response.status_code != 200:
+            fail(response)
+        output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        lines = 0
+        try:
+            for chunk in response.iter_content(chunk_size=65536):
+                output.write(chunk)
+                lines += chunk.count(b'\n')
+        finally:
+            if args.output:
+                output.close()
+            else:
+                output.flush()
+    if args.format == 'csv':
+        lines -= 1
+    print(f"Exported {lines} {args.kind}", file=sys.stderr)
+
+
+def show_item_stats(args):
+    token = args.token or os.environ.get('ADMIN_TOKEN')
+    if not token:
+        sys.exit("Error: set ADMIN_TOKEN or pass --token")
+    response = requests.get(f"{BASE_URL}/api/admin/stats/items", headers={'Authorization': f"Bearer {token}"})
+    if response.status_code != 200:
+        fail(response)
+    table_data = [[item['item_id'], item['name'], item['currency'], item['owners']] for item in response.json()]
+    print(tabulate(table_data, headers=["Item", "Name", "Currency", "Owners"], tablefmt="grid"))
+
+
+def profile(args):
+    # start / stop / status, or report: prints the hot-function table and
+    # saves the merged collapsed stacks for flamegraph.pl or speedscope
+    token = args.token or os.environ.get('ADMIN_TOKEN')
+    if not token:
+        sys.exit("Error: set ADMIN_TOKEN or pass --token")
+    url = f"{BASE_URL}/api/admin/profile"
+    headers = {'Authorization': f"Bearer {token}"}
+    if args.action == 'start':
+        options = {'seconds': args.seconds, 'rate': args.rate, 'interval_ms': args.interval_ms}
+        response = requests.post(url, json={name: value for name, value in options.items() if value is not None}, headers=headers)
+    elif args.action == 'stop':
+        response = requests.delete(url, headers=headers)
+    else:
+        response = requests.get(url, headers=headers)
+    if response.status_code not in (200, 201):
+        fail(response)
+    if args.action != 'report':
+        print(json.dumps(response.json(), indent=2))
+        return
+
+    session = args.session or (response.json()['sessions'] or [None])[-1]
+    if not session:
+        sys.exit("Error: no profiling sessions recorded")
+    params = {'route': args.route, 'limit': args.limit}
+    response = requests.get(f"{url}/{session}", params=params, headers=headers)
+    if response.status_code != 200:
+        fail(response)
+    report = response.json()
+    print(f"Session {session}: {report['samples']} samples")
+    table_data = [[route, counts['requests'], counts['samples']] for route, counts in sorted(report['routes'].items())]
+    print(tabulate(table_data, headers=["Route", "Requests", "Samples"], tablefmt="grid"))
+    table_data = [[row['function'], row['self'], row['self_percent'], row['total'], row['total_percent']] for row in report['top']]
+    print(tabulate(table_data, headers=["Function", "Self", "Self %", "Total", "Total %"], tablefmt="grid"))
+
+    response = requests.get(f"{url}/{session}", params={'route': args.route, 'format': 'folded'}, headers=headers)
+    if response.status_code != 200:
+        fail(response)
+    output = args.output or f"{session}.folded"
+    with open(output, 'w') as folded:
+        folded.write(response.text)
+    print(f"Collapsed stacks written to {output}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Yara Miner admin tool")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    top = commands.add_parser('top', help="leaderboard page")
+    top.add_argument('--offset', type=int, default=0)
+    top.add_argument('--limit', type=int, default=10)
+    top.set_defaults(handler=show_top)
+
+    user = commands.add_parser('user', help="one user's details")
+    user.add_argument('user_id')
+    user.set_defaults(handler=show_user)
+
+    referrals = commands.add_parser('referrals', help="one user's referrals")
+    referrals.add_argument('user_id')
+    referrals.set_defaults(handler=show_referrals)
+
+    export_parser = commands.add_parser('export', help="stream all users, referrals, task completions or owned items")
+    export_parser.add_argument('kind', choices=['users', 'referrals', 'tasks', 'items'])
+    export_parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    export_parser.add_argument('--min-balance', type=float)
+    export_parser.add_argument('--max-balance', type=float)
+    export_parser.add_argument('--has-wallet', choices=['yes', 'no'])
+    export_parser.add_argument('--joined-since', help="ISO date, e.g. 2024-06-01")
+    export_parser.add_argument('--output', help="file to write instead of stdout")
+    export_parser.add_argument('--token', help="admin token (default: $ADMIN_TOKEN)")
+    export_parser.set_defaults(handler=export)
+
+    item_stats = commands.add_parser('items', help="how many users own each store item")
+    item_stats.add_argument('--token', help="admin token (default: $ADMIN_TOKEN)")
+    item_stats.set_defaults(handler=show_item_stats)
+
+    profile_parser = commands.add_parser('profile', help="start, stop or report an on-demand profiling session")
+    profile_parser.add_argument('action', choices=['start', 'stop', 'status', 'report'])
+    profile_parser.add_argument('session', nargs='?', help="session to report (default: the latest)")
+    profile_parser.add_argument('--seconds', type=float)
+    profile_parser.add_argument('--rate', type=float, help="fraction of requests sampled")
+    profile_parser.add_argument('--interval-ms', type=float, help="time between stack samples")
+    profile_parser.add_argument('--route', help="only this endpoint, e.g. api.purchase")
+    profile_parser.add_argument('--limit', type=int, default=20, help="hot functions to list")
+    profile_parser.add_argument('--output', help="collapsed stacks file (default: <session>.folded)")
+    profile_parser.add_argument('--token', help="admin token (default: $ADMIN_TOKEN)")
+    profile_parser.set_defaults(handler=profile)
+
+    args = parser.parse_args()
+    args.handler(args)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
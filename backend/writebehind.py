@@ -0,0 +1,151 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindFull(Exception):
+    pass
+
+
+class PendingWrite:
+    __slots__ = ('delta', 'values', 'tasks', 'ops')
+
+    def __init__(self):
+        self.delta = 0.0
+        self.values = {}
+        self.tasks = {}
+        self.ops = 0
+
+    def merge(self, newer):
+        self.delta += newer.delta
+        self.values.update(newer.values)
+        self.tasks.update(newer.tasks)
+        self.ops += newer.ops
+
+
+class WriteBehind:
+    # Coalesces per-user writes in memory and hands them to `flush` as one
+    # batch every `interval_ms` or once `max_ops` writes have queued up.
+    # Balance deltas are summed, column values keep the latest write and task
+    # completions keep the latest timestamp. When `max_pending` writes are
+    # waiting, callers block for up to `put_timeout` seconds and then get
+    # WriteBehindFull, so a stuck database cannot grow the queue unbounded.
+
+    def __init__(self, flush, interval_ms=50, max_ops=500, max_pending=10000, put_timeout=1.0):
+        self._flush = flush
+        self.interval = interval_ms / 1000
+        self.max_ops = max_ops
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self._pending = {}
+        self._ops = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+    def add(self, user_id, delta=0.0, values=None, tasks=None):
+        self._ensure_started()
+        deadline = time.monotonic() + self.put_timeout
+        with self._changed:
+            while self._ops >= self.max_pending:
+                self._changed.notify_all()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WriteBehindFull()
+                self._changed.wait(remaining)
+            write = self._pending.get(user_id)
+            if write is None:
+                write = self._pending[user_id] = PendingWrite()
+            write.delta += delta
+            write.values.update(values or {})
+            write.tasks.update(tasks or {})
+            write.ops += 1
+            self._ops += 1
+            if self._ops >= self.max_ops:
+                self._changed.notify_all()
+
+    def pending(self, user_id):
+        with self._lock:
+            return self._pending.get(user_id)
+
+    def snapshot(self, user_id, load):
+        # Runs `load` while no flush is in progress, so the value it reads
+        # from the database and the pending writes returned alongside it
+        # never count the same delta twice or miss it entirely.
+        with self._flush_lock:
+            return load(), self.pending(user_id)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._changed:
+                batch, self._pending = self._pending, {}
+                self._ops = 0
+                self._changed.notify_all()
+            return self._write(batch)
+
+    def flush_user(self, user_id):
+        # Commits one user's queued writes ahead of the next batch, for
+        # request paths that must see them in the database (e.g. a purchase
+        # checking the balance right after a queued balance update).
+        with self._flush_lock:
+            with self._changed:
+                write = self._pending.pop(user_id, None)
+                if write is None:
+                    return 0
+                self._ops -= write.ops
+                self._changed.notify_all()
+            return self._write({user_id: write})
+
+    def _write(self, batch):
+        if not batch:
+            return 0
+        try:
+            self._flush(batch)
+        except Exception:
+            logger.exception("Write-behind flush failed, requeueing %d users", len(batch))
+            with self._changed:
+                for user_id, write in batch.items():
+                    self._ops += write.ops
+                    current = self._pending.get(user_id)
+                    if current is not None:
+                        write.merge(current)
+                    self._pending[user_id] = write
+            raise
+        return len(batch)
+
+    def stop(self):
+        self._stopping = True
+        with self._changed:
+            self._changed.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.put_timeout + self.interval)
+        self.flush()
+
+    def _ensure_started(self):
+        # The flusher thread has to be started lazily: a thread created in the
+        # gunicorn master does not survive the fork into a worker.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            with self._changed:
+                if self._ops < self.max_ops:
+                    self._changed.wait(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.interval)
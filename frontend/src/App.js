@@ -14,6 +14,10 @@ import { TelegramContext } from './context/TelegramContext';
 import { TonConnectUIProvider } from '@tonconnect/ui-react';
 import './App.css';
 
+// /api/events is served by its own gevent server (backend/gunicorn.events.conf.py)
+// when one is deployed; without it the API server streams as well
+const EVENTS_URL = process.env.REACT_APP_EVENTS_URL || 'https://yara-mine.onrender.com';
+
 function App() {
     const { telegramUser } = useContext(TelegramContext);
     const [user, setUser] = useState(null);
@@ -24,6 +28,7 @@ function App() {
     const [balanceMultiplier, setBalanceMultiplier] = useState(1);
     const [cipherStatus, setCipherStatus] = useState({ solved: false, nextAvailableTime: null });
     const [timeLeft, setTimeLeft] = useState('');
+    const [initialTasks, setInitialTasks] = useState(null);
     
     const tg = window.Telegram.WebApp;
     const theme = {
@@ -90,6 +95,8 @@ function App() {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    // Lets the backend answer a retried request without applying it twice
+                    'Idempotency-Key': crypto.randomUUID(),
                 },
                 body: JSON.stringify({ user_id: user.user_id }),
             });
@@ -140,7 +147,8 @@ function App() {
         console.log("Referral code from start_param:", referralCode);
     
         try {
-            const response = await fetch('https://yara-mine.onrender.com/api/user/check_and_create', {
+            // One request for the user and the main screen's task list
+            const response = await fetch('https://yara-mine.onrender.com/api/bootstrap?fields=user,tasks', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -161,9 +169,11 @@ function App() {
                 throw new Error(`Failed to fetch user data: ${response.status} ${errorText}`);
             }
     
-            const userData = await response.json();
+            const bootstrapData = await response.json();
+            const userData = bootstrapData.user;
             console.log("Received user data:", userData);
 
+            setInitialTasks(bootstrapData.tasks);
             setUser(userData);
             setBalance(userData.balance);
             setBalanceMultiplier(userData.balance_multiplier || 1);
@@ -184,6 +194,55 @@ function App() {
         }
     }, [telegramUser]);
 
+    useEffect(() => {
+        if (!user) return;
+        // Balance and claim changes are pushed by the server instead of polled.
+        // EventSource gives up for good when the server turns a stream away
+        // (503 when the events server is at its stream cap), so then the
+        // balance is fetched once and a new stream is tried after a delay
+        // that doubles with every refusal, up to 15 minutes.
+        let events = null;
+        let retry = null;
+        let delay = 60000;
+
+        const refreshBalance = async () => {
+            try {
+                const response = await fetch(`https://yara-mine.onrender.com/api/user/${user.user_id}`);
+                if (response.ok) {
+                    setBalance((await response.json()).balance);
+                }
+            } catch (error) {
+                console.error('Failed to refresh balance:', error);
+            }
+        };
+
+        const connect = () => {
+            events = new EventSource(`${EVENTS_URL}/api/events/${user.user_id}`);
+            events.onopen = () => {
+                delay = 60000;
+            };
+            events.addEventListener('balance', (event) => {
+                setBalance(JSON.parse(event.data).balance);
+            });
+            events.addEventListener('claim', (event) => {
+                setNextClaimTime(new Date(JSON.parse(event.data).next_claim_time + 'Z').getTime());
+            });
+            events.onerror = () => {
+                if (events.readyState === EventSource.CLOSED) {
+                    refreshBalance();
+                    retry = setTimeout(connect, delay);
+                    delay = Math.min(delay * 2, 15 * 60 * 1000);
+                }
+            };
+        };
+
+        connect();
+        return () => {
+            clearTimeout(retry);
+            if (events) events.close();
+        };
+    }, [user]);
+
     useEffect(() => {
         const tg = window.Telegram.WebApp;
         tg.BackButton.show();
@@ -244,7 +303,7 @@ function App() {
                                             balanceMultiplier={balanceMultiplier}
                                         />
                                     </div>
-                                    <TaskList userId={user.user_id} onBalanceUpdate={setBalance} />
+                                    <TaskList userId={user.user_id} initialTasks={initialTasks} onBalanceUpdate={setBalance} />
                                     <div className="cipher-game">
                                         <h3>Cipher Game</h3>
                                         {cipherStatus.solved ? (
@@ -3,7 +3,7 @@ import React from 'react';
 function Balance({ balance }) {
     return (
         <div className="balance">
-            <h2>{balance} YARA</h2>
+            <h2>{Number(balance).toFixed(2)} YARA</h2>
         </div>
     );
 }
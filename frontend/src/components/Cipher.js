@@ -18,10 +18,19 @@ const Cipher = ({ userId, onBalanceUpdate }) => {
     const fetchCipherStatus = async () => {
         setIsLoading(true);
         try {
-            const response = await fetch(`https://yara-mine.onrender.com/api/user/${userId}`);
-            const userData = await response.json();
+            const [userResponse, cipherResponse] = await Promise.all([
+                fetch(`https://yara-mine.onrender.com/api/user/${userId}`),
+                fetch('https://yara-mine.onrender.com/api/cipher'),
+            ]);
+            const userData = await userResponse.json();
             setSolved(userData.cipher_solved);
             setNextAvailableTime(userData.next_cipher_time);
+            if (cipherResponse.ok) {
+                // The puzzle rotates daily, so its length can change
+                const cipher = await cipherResponse.json();
+                setReward(cipher.reward);
+                setInputs((current) => current.length === cipher.length ? current : Array(cipher.length).fill(''));
+            }
         } catch (error) {
             console.error('Failed to fetch cipher status:', error);
             toast.error('Failed to fetch cipher status');
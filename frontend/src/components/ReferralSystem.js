@@ -4,7 +4,10 @@ import { toast } from 'react-toastify';
 function ReferralSystem({ userId }) {
     const [referralLink, setReferralLink] = useState('');
     const [referrals, setReferrals] = useState([]);
+    const [referralCount, setReferralCount] = useState(0);
+    const [nextCursor, setNextCursor] = useState(null);
     const [isLoading, setIsLoading] = useState(true);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
 
     useEffect(() => {
         fetchReferralData();
@@ -19,7 +22,9 @@ function ReferralSystem({ userId }) {
             }
             const data = await response.json();
             setReferralLink(data.referral_link);
+            setReferralCount(data.referral_count || 0);
             setReferrals(data.referrals || []); // Use an empty array if no referrals
+            setNextCursor(data.next_cursor || null);
         } catch (error) {
             console.error('Failed to fetch referral data:', error);
             toast.error('Failed to fetch referral data');
@@ -27,6 +32,26 @@ function ReferralSystem({ userId }) {
             setIsLoading(false);
         }
     };
+
+    // The endpoint returns one page at a time; next_cursor fetches the next
+    const loadMoreReferrals = async () => {
+        if (!nextCursor) return;
+        setIsLoadingMore(true);
+        try {
+            const response = await fetch(`https://yara-mine.onrender.com/api/referrals/${userId}?after=${nextCursor}`);
+            if (!response.ok) {
+                throw new Error('Failed to fetch referral data');
+            }
+            const data = await response.json();
+            setReferrals(current => [...current, ...(data.referrals || [])]);
+            setNextCursor(data.next_cursor || null);
+        } catch (error) {
+            console.error('Failed to fetch more referrals:', error);
+            toast.error('Failed to fetch more referrals');
+        } finally {
+            setIsLoadingMore(false);
+        }
+    };
     
     const copyToClipboard = (text, message) => {
         navigator.clipboard.writeText(text)
@@ -50,19 +75,26 @@ function ReferralSystem({ userId }) {
             <p>Share this link with your friends to an additional 2000 $YARA!</p>
 
             <div className="claim-all-section">
-                <h3>Your Referrals: {referrals.length}</h3>
+                <h3>Your Referrals: {referralCount}</h3>
             </div>
 
             <h3>Referral Details</h3>
             {referrals.length > 0 ? (
-                <ul>
-                    {referrals.map(referral => (
-                        <li key={referral.id}>
-                            <span> {referral.username}</span>
-                            <span> {referral.balance} YARA</span>
-                        </li>
-                    ))}
-                </ul>
+                <>
+                    <ul>
+                        {referrals.map((referral, index) => (
+                            <li key={index}>
+                                <span> {referral.username}</span>
+                                <span> {Number(referral.balance).toFixed(2)} YARA</span>
+                            </li>
+                        ))}
+                    </ul>
+                    {nextCursor && (
+                        <button onClick={loadMoreReferrals} disabled={isLoadingMore}>
+                            {isLoadingMore ? 'Loading...' : 'Load more'}
+                        </button>
+                    )}
+                </>
             ) : (
                 <p>You haven't referred anyone yet.</p>
             )}
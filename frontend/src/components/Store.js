@@ -124,6 +124,8 @@ function Store({ userId, balance, setBalance }) {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    // Lets the backend answer a retried request without applying it twice
+                    'Idempotency-Key': crypto.randomUUID(),
                 },
                 body: JSON.stringify({ user_id: userId, item_id: item.id }),
             });
@@ -1,11 +1,14 @@
 import React, { useState, useEffect } from 'react';
 import { toast } from 'react-toastify';
 
-function TaskList({ userId, onBalanceUpdate }) {
-    const [tasks, setTasks] = useState([]);
+function TaskList({ userId, initialTasks, onBalanceUpdate }) {
+    const [tasks, setTasks] = useState(initialTasks || []);
 
     useEffect(() => {
-        fetchTasks();
+        // The task list already arrived with the bootstrap response
+        if (!initialTasks) {
+            fetchTasks();
+        }
         const intervalId = setInterval(fetchTasks, 600000); // Refresh every minute
         return () => clearInterval(intervalId);
     }, [userId])
@@ -48,7 +51,13 @@ function TaskList({ userId, onBalanceUpdate }) {
                 const errorData = await response.json();
                 throw new Error(errorData.error || 'Failed to verify task');
             }
-            await fetchTasks();
+            if (response.status === 202) {
+                // Telegram/Twitter checks run in the background
+                const { job_id } = await response.json();
+                await waitForVerification(job_id);
+            }
+            // Completed tasks drop out of the list, so there is no need to refetch it
+            setTasks((current) => current.filter((task) => task.id !== taskId));
             toast.success('Task completed! You can claim your reward in 1 minute.');
         } catch (error) {
             console.error('Error verifying task:', error);
@@ -56,17 +65,30 @@ function TaskList({ userId, onBalanceUpdate }) {
         }
     };
 
+    const waitForVerification = async (jobId) => {
+        for (let attempt = 0; attempt < 30; attempt++) {
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            const response = await fetch(`https://yara-mine.onrender.com/api/verify_task/${jobId}`);
+            if (!response.ok) throw new Error('Failed to verify task');
+            const job = await response.json();
+            if (job.status === 'verified') return;
+            if (job.status === 'failed') throw new Error('Verification failed. Please complete the task first.');
+            if (job.status === 'error') throw new Error('Could not verify the task right now. Please try again.');
+        }
+        throw new Error('Verification is taking too long. Please try again.');
+    };
+
     const handleClaimTask = async (taskId) => {
         try {
             const response = await fetch('https://yara-mine.onrender.com/api/claim_task', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Idempotency-Key': crypto.randomUUID() },
                 body: JSON.stringify({ user_id: userId, task_id: taskId }),
             });
             if (!response.ok) throw new Error('Failed to claim task');
             const data = await response.json();
             onBalanceUpdate(data.new_balance);
-            await fetchTasks();
+            setTasks((current) => current.filter((task) => task.id !== taskId));
             toast.success('Reward claimed successfully!');
         } catch (error) {
             console.error('Error claiming task:', error);